@@ -24,118 +24,178 @@ Furthurmore, I grant the right to use excerpts from the source to Meikaichan
 without express permission, with exclusion of commercial application.
 """
 
-from Tkinter import *
-import random
-import json
-import pygame
-import tkMessageBox
-import tkFileDialog
-import codecs
-
-codecs.register(lambda name: codecs.lookup('utf-8') if name == 'cp65001' else None)
-pygame.mixer.init(16000)
+from timers import Stopwatch
 
-DISPLAY_FORMAT = "{0}{1}{2}{4}"
+#Started before anything else is imported, for the startup timing report.
+STARTUP = Stopwatch()
 
-class Kanjicard(object):
+import os
+import sys
+import threading
+import sqlite3
+from Tkinter import *
+from cards import Kanjicard, Cardlist, DeckWatcher
+from deckcache import DeckCache
+from srs import ReviewScheduler, schedule_path
+from reviewlog import ReviewLog
+from assets import ImageCache, AudioBank, AssetValidator
+from quiz import QuizSession, MEIKAI, SEIKAI, REIKAI, CORRECT_SOUND, WRONG_SOUNDS, ANSWER_SECONDS
+from timers import Scheduler, Countdown
+from lookup import is_kana
+from atlas import AtlasIndex, atlas_path, CELL_WIDTH, CELL_HEIGHT
+import instrument
+from instrument import INSTRUMENTS, measure, timed
+
+#pygame and the Tk dialog modules are imported where they are first used, so
+#the window appears without waiting for them.
+
+#Show debugging counters, such as the live canvas item count, in the title.
+DEBUG = False
+
+#Seconds the verdict is shown for.
+VERDICT_SECONDS = 1
+
+#Card images kept in the cache once every image of a deck is decoded to
+#check it, and how many are decoded per idle callback.
+WARM_IMAGES = 64
+WARM_BATCH = 4
+
+#Seconds between checks of the open deck file for changes.
+RELOAD_INTERVAL = 1.0
+
+#Mixer frequency, and seconds after the first paint at which it is set up.
+MIXER_FREQUENCY = 16000
+AUDIO_DELAY = 0.1
+
+class PygameAudio(object):
+    """Audio sink for QuizSession which plays clips through pygame.
+
+    pygame is imported and the mixer set up on a background thread by
+    start, or on first use if start was not called. Clips are decoded into
+    pygame.mixer.Sound objects once and kept in an AudioBank. The feedback
+    clips are decoded with the mixer and never evicted. If the mixer cannot
+    be set up, audio is silent.
+    """
 
-    def __init__(self, meaning, kanji, hiragana, image, audio):
-        """Initializes the Kanji Card, supplying it with a kanji, meaning, and
+    def __init__(self):
+        """Initializes the audio bank. Nothing is imported or decoded yet.
 
-        image file name.
+        __init__(PygameAudio) --> void
         """
-        self._kanji = kanji
-        self._hiragana = hiragana
-        self._meaning = meaning
-        self._image = image
-        self._audio = audio
-
-    def get_kanji(self):
-        """Returns the Kanji of a card.
-
-        get_kanji(self._kanji) --> str
+        self._bank = AudioBank(self._decode, self._sound_bytes)
+        self._feedback = {}
+        self._pygame = None
+        self._channel = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._ready = threading.Event()
+
+    def start(self):
+        """Sets the mixer up on a background thread, if not yet started.
+
+        start(PygameAudio) --> void
         """
-        return self._kanji
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._setup)
+                self._thread.daemon = True
+                self._thread.start()
 
-    def get_hiragana(self):
-        return self._hiragana
+    def _setup(self):
+        """Imports pygame, initializes the mixer and decodes the feedback
 
-    def get_meaning(self):
-        """Returns the meaning of a card.
+        clips.
 
-        get_meaning(self._meaning) --> str
+        _setup(PygameAudio) --> void
         """
-        return self._meaning
-
-    def get_image(self):
-        """Returns the image file of a card.
-
-        get_image(self._image) --> str
+        try:
+            import pygame
+            pygame.mixer.init(MIXER_FREQUENCY)
+            for path in [CORRECT_SOUND] + list(WRONG_SOUNDS.values()):
+                try:
+                    self._feedback[path] = pygame.mixer.Sound(path)
+                except pygame.error:
+                    pass
+            self._channel = pygame.mixer.Channel(0)
+            self._pygame = pygame
+        except Exception as e:
+            sys.stderr.write("Audio unavailable: {0}\n".format(e))
+        finally:
+            self._ready.set()
+
+    def _mixer(self):
+        """Waits for the mixer and returns pygame, or None if the mixer
+
+        could not be set up.
+
+        _mixer(PygameAudio) --> module
         """
-        return self._image
+        self.start()
+        self._ready.wait()
+        return self._pygame
 
-    def get_audio(self):
-        """Returns the audio file of a card.
+    @timed('audio_decode')
+    def _decode(self, path):
+        """Decodes the audio file at path into a Sound.
 
-        get_audio(self._audio) --> str
+        _decode(PygameAudio, str) --> Sound
         """
-        return self._audio
+        pygame = self._mixer()
+        if pygame is None:
+            raise IOError("audio unavailable")
+        return pygame.mixer.Sound(path)
 
-    def __str__(self):
-        """Returns a str of Kanjicard in DISPLAY_FORMAT.
+    def _sound_bytes(self, sound):
+        """Returns the bytes of memory a decoded sound occupies.
 
-        __str__(Kanjicard) --> str"""
-        return DISPLAY_FORMAT.format(self.get_kanji, self.get_meaning, self.get_image)
-
-    def __repr__(self):
-        """Returns a repr of Kanjicard.
-
-        __repr__(Kanjicard) --> str"""
-        return "Kanjicard({0}, {1}, {2}, {3})".format(self.get_kanji, self.get_meaning, self.get_image)
-
-class Cardlist(object):
-
-    def __init__(self):
-        """Initializes the Cards List to be empty.
-
-        __init__(Cardlist) --> void
+        _sound_bytes(PygameAudio, Sound) --> int
         """
+        frequency, size, channels = self._pygame.mixer.get_init()
+        return int(sound.get_length() * frequency * channels * abs(size) // 8)
 
-        self._cards = []
-        
-    def load_file(self, filename):
-        """Read a Cardlist from a .json file.
+    @timed('audio_play')
+    def play(self, path):
+        """Plays the audio file at path, stopping any clip still playing.
 
-        load_file(dict) -> list((kanji, meaning, image, audio))
-        """
-        fd = codecs.open(filename, 'rU', 'utf-8')
-        tmp_dict = json.load(fd, 'utf-8')
-        for key in tmp_dict:
-            meaning = key
-            kanji, hiragana, image, audio = tmp_dict[key]
-            self._cards.append(Kanjicard(meaning, kanji, hiragana, image, audio))
-        fd.close()
-
-    def get_index(self, index):
-        """Returns the index of a card.
+        Falls back to streaming through pygame.mixer.music if the file
+        cannot be decoded into a Sound.
 
-        get_index(Cardlist, index) --> index
+        play(PygameAudio, str) --> void
         """
-        return self._cards[index]
+        pygame = self._mixer()
+        if pygame is None:
+            return
+        sound = self._feedback.get(path)
+        if sound is None:
+            try:
+                sound = self._bank.load(path)
+            except pygame.error:
+                self._channel.stop()
+                pygame.mixer.music.load("{}".format(path))
+                pygame.mixer.music.play()
+                return
+        pygame.mixer.music.stop()
+        self._channel.play(sound)
 
-    def length(self):
-        """Returns the length of the card list.
+    def warm(self, path):
+        """Decodes the audio file at path into the bank now, if it can be.
 
-        length(Cardlist) --> length
+        warm(PygameAudio, str) --> void
         """
-        return len(self._cards)
+        pygame = self._mixer()
+        if pygame is not None and path not in self._feedback:
+            try:
+                self._bank.load(path)
+            except pygame.error:
+                pass
 
-    def __str__(self):
-        """Returns a str of the card list.
+    def prefetch(self, path):
+        """Decodes the audio file at path in the background.
 
-        __str__(Cardlist) --> str
+        prefetch(PygameAudio, str) --> void
         """
-        return "{0}".format(self._cards)
+        if path not in self._feedback:
+            self._bank.prefetch(path)
 
 class Controller(object):
     def __init__(self, master):
@@ -146,11 +206,6 @@ class Controller(object):
         __init__(Controller, tk) --> void
         """
         
-        #Global elements
-
-        #Displayed list
-        self._displayed = []
-        
         #setup the app basic specifications: title, close protocol, size.
         self._master = master
         master.title("Meikaichan 1.0")
@@ -158,23 +213,26 @@ class Controller(object):
         master.minsize(500, 375)
         master.maxsize(700, 525)
         
-        #Initialize a Cardlist, attempt count, and correct answer count.
-        self._items = Cardlist()
-        self._acount = 0
-        self._ccount = 0
-        
-        #Set up a random audio file for incorrect answers.
-        self._shikkari = ""
-        self._chigau = ""
-        self._aho = ""
-        self._batsu = []
-        self._rnum = int
-
-        #Initialize the mode flags, set default to Meikai.
-        self._meikai = True
-        self._seikai = 0
-        self._reikai = 0
-        self._timestart = True
+        #Initialize a Cardlist and a quiz session over it, default to Meikai.
+        #The session keeps the attempt and correct answer counts and calls
+        #back into show_question and show_verdict to update the widgets.
+        self._items = Cardlist(DeckCache())
+        self._schedule = ReviewScheduler()
+        self._deckfile = None
+        #Run without a review log if its database cannot be opened.
+        try:
+            self._log = ReviewLog()
+        except (sqlite3.Error, EnvironmentError):
+            self._log = None
+        self._audio = PygameAudio()
+        self._validator = None
+        #Image paths found broken, shown as the default image.
+        self._broken = set()
+        self._watcher = None
+        #True while the quiz widgets are shown; reset by hide_all.
+        self._playing = False
+        self._session = QuizSession(self._items, MEIKAI, renderer=self, audio=self._audio,
+                                    scheduler=self._schedule, recorder=self._log)
 
         #Create a menubar
         menubar = Menu(master)
@@ -184,6 +242,8 @@ class Controller(object):
         menubar.add_cascade(label="File", menu=filemenu)
         filemenu.add_command(label="Open Card List", command=self.open_file)
         filemenu.add_command(label="Save Card List", command=self.save)
+        filemenu.add_command(label="Filter Cards", command=self.filter_cards)
+        filemenu.add_command(label="Toggle Timing", command=self.toggle_timing)
         filemenu.add_command(label="Meikaimodo", command=self.meikai)
         filemenu.add_command(label="Seikaimodo", command=self.seikai)
         filemenu.add_command(label="Reikaimodo", command=self.reikai)
@@ -203,10 +263,23 @@ class Controller(object):
         self._c = Canvas(self._Cframe, width=350, height=350, background = 'white')
         self._c.pack(expand = YES, fill = BOTH)
         
+        #Decode the overlays once, card images are decoded on first use and cached.
+        self._images = ImageCache(timed('image_decode')(lambda path: PhotoImage(file=path)),
+                                  lambda image: image.width() * image.height() * 4)
         self._c.default = PhotoImage(file='img/default.gif')
-        self._item = self._c.create_image(25, 25, image=self._c.default, anchor=NW)
+        self._c.blank = PhotoImage(file='img/blank.gif')
+        self._c.maru = PhotoImage(file='img/maru.gif')
+        self._c.batsu = PhotoImage(file='img/batsu.gif')
+        #Cards held by the deck's texture atlas are copied into this image
+        #from their sheet, decoded on first use into the image cache.
+        self._atlas = None
+        self._c.card = PhotoImage(width=CELL_WIDTH, height=CELL_HEIGHT)
+        #The canvas holds one item per layer, the card art and the verdict
+        #overlay above it. They are reused with itemconfig, never recreated.
+        self._c.current = self._c.default
+        self._item = self._c.create_image(25, 25, image=self._c.current, anchor=NW)
         
-        self._c.true = PhotoImage(file='img/blank.gif')
+        self._c.true = self._c.blank
         self._marui = self._c.create_image(25, 25, image=self._c.true, anchor=NW)
 
         #Create a frame, pack entry and widget, submit and listen to it. Hide on open.
@@ -242,340 +315,512 @@ class Controller(object):
         #Pack a timer to the frame, call a function if the timer reaches zero.
         self._timer = Canvas(frame3, width=27, height=27, bg = 'white', bd = 3, relief=RIDGE)
         self._timer.pack_forget()
+        self._timertext = self._timer.create_text(17, 17, text="", anchor = CENTER)
+
+        #All after() calls go through one scheduler, so reopening a deck or
+        #switching modes replaces the countdown instead of adding another.
+        self._scheduler = Scheduler(master)
+        self._countdown = Countdown(self._scheduler, 'countdown', ANSWER_SECONDS,
+                                    self.tick, self.time_up)
 
-    def tick(self):
-        """Set a timer to a canvas which counts down, changes color when below 5
+        #Set the mixer up in the background once the window is showing.
+        self._scheduler.call_later('audio', AUDIO_DELAY, self._audio.start)
 
-        and checks the entry field or returns an incorrect answer
+    def tick(self, remaining):
+        """Shows the seconds remaining on the timer canvas, which turns red
 
-        tick(Controller) --> void
+        at 5 seconds.
+
+        tick(Controller, int) --> void
         """
-        self._timer.delete(ALL)
-        global time
-        self._time -= 1
-        self._timer.create_text(17, 17, text=self._time, anchor = CENTER)
-        
-        if self._time == 5:
+        self._timer.itemconfig(self._timertext, text=remaining)
+        if remaining == 5:
             self._timer.config(bg = 'red')
-            
-        if self._time == 0:
-            if self._seikai or self._reikai:
-                self.Entry_submit()
-                self._time = 21
-                self._timer.config(bg = 'white')
-                self._timer.after(1000, self.tick)
-            elif self._meikai:
-                pygame.mixer.music.load('sound/chigau.mp3')
-                pygame.mixer.music.play()
-                self._c.true = PhotoImage(file='img/batsu.gif')
-                self._marui = self._c.create_image(25, 25, image=self._c.true, anchor=NW)
-                self._clabel.config(bg = 'grey')
-                self._time = 21
-                self._timer.config(bg = 'white')
-                self._timer.after(1000, self.tick)
-                self.marutick()
+
+    def time_up(self):
+        """Called when the countdown runs out. Checks the entry field, or
+
+        in Meikai mode marks the card incorrect.
+
+        time_up(Controller) --> void
+        """
+        self._timer.itemconfig(self._timertext, text=0)
+        if self._session.get_mode() != MEIKAI:
+            self.Entry_submit()
         else:
-            self._timer.after(1000, self.tick)
+            self._session.expire()
+            self.marutick()
             
     def marutick(self):
-        """Set a timer for displaying Red correct circle and incorrect cross
+        """Shows the red correct circle or incorrect cross for VERDICT_SECONDS
+
+        before moving on to the next card.
 
         marutick(Controller) --> void
         """
-        global time
-        self._marutime -= 1
-        if self._marutime == 0:
-            self.refresh()
-        else:
-            self._master.after(1000, self.marutick)
+        self._scheduler.call_later('verdict', VERDICT_SECONDS, self.refresh)
     
     def open_file(self):
         """Opens the tkInter Filedialog to select a file.
 
-        If filename is true, runs load_file on the filename.
+        If filename is true, replaces the cards with those of the file and
+        watches it for changes.
 
         Packs buttons to un-hide. runs self.refresh().
         
         open_file(Controller) --> load_file(filename)
         """
+        import tkFileDialog
         filename = tkFileDialog.askopenfilename()
         
         if filename:
-            self._items.load_file(filename)
-            if self._meikai:
+            #Replace the cards of any deck already open, after saving its
+            #schedule and stopping its question. A file without valid cards
+            #leaves the open deck as it is.
+            self.save()
+            report = self._items.replace_file(filename)
+            if not report.loaded:
+                import tkMessageBox
+                tkMessageBox.showwarning('Deck Problems', u"\n".join(
+                    [u"No cards loaded from {0}".format(filename)] + report.get_lines()[1:20]))
+                return
+            self._countdown.stop()
+            self._scheduler.cancel('verdict')
+            self._session.restart()
+            self._scheduler.call_later('index', 0.05, self.index_deck)
+            self._deckfile = filename
+            self._schedule.clear()
+            self._schedule.load(schedule_path(filename))
+            self.load_atlas(filename)
+            self._watcher = DeckWatcher(filename)
+            self._scheduler.call_later('reload', RELOAD_INTERVAL, self.poll_deck)
+
+            #Check every image and audio file of the deck in the background.
+            self._broken = set()
+            self._validator = AssetValidator(self._items, warm_audio=self._audio.warm)
+            self._scheduler.call_later('assets', 0.25, self.check_assets)
+            if not report.is_clean():
+                import tkMessageBox
+                tkMessageBox.showwarning('Deck Problems', u"\n".join(report.get_lines()[:20]))
+            mode = self._session.get_mode()
+            if mode == MEIKAI:
                 self._timer.pack(side=LEFT, pady=10, padx=20)
                 self._button1.pack(side=LEFT, pady = 10, padx = 10)
                 self._button2.pack(side=LEFT, pady = 10, padx = 10)
                 self._button3.pack(side=LEFT, pady = 10, padx = 10)
                 self._playaudio.pack(side=LEFT, pady=10, padx = 20)
-                self._time = 21
-##                if self._timestart == True:
-##                    self._timer.after(1, self.tick)
 
-            if self._seikai:
+            elif mode == SEIKAI:
                 self._timer.pack(side=LEFT)
                 self._entry.pack(side=LEFT, pady = 10)
                 self._submit.pack(side=LEFT, pady = 10, padx = 10)
                 self._playaudio.pack(side=LEFT, pady=10)
-                self._timer.after(1, self.tick)
-                self._time = 21
-##                if self._timestart == True:
-##                    self._timer.after(1, self.tick)
-                
-            elif self._reikai:
+
+            elif mode == REIKAI:
                 self._timer.pack(side=LEFT)
                 self._entry.pack(side=LEFT, pady = 10)
                 self._submit.pack(side=LEFT, pady = 10, padx = 10)
-                self._timer.after(1, self.tick)
-                self._time = 21
-##                if self._timestart == True:
-##                    self._timer.after(1, self.tick)
-
-            elif self._timestart == True:
-                self._timer.after(1, self.tick)
-                    
-            self._timestart = False
+
+            self._playing = True
             self.refresh()
             
+    def poll_deck(self):
+        """Checks whether the open deck file changed and, if so, applies the
+
+        changes to the loaded cards without restarting the session. A new
+        question is asked if the current one was edited or removed.
+
+        poll_deck(Controller) --> void
+        """
+        self._scheduler.call_later('reload', RELOAD_INTERVAL, self.poll_deck)
+        if not self._watcher.changed():
+            return
+        report, changes = self._items.reload_file(self._deckfile)
+        if report.malformed or not report.loaded:
+            self._master.title("Meikaichan 1.0 [deck not reloaded: {0} malformed entries]".format(
+                len(report.malformed)))
+            return
+        self._master.title("Meikaichan 1.0")
+        if changes:
+            self._scheduler.call_later('index', 0.05, self.index_deck)
+        if changes and self._session.apply_changes(changes) and self._playing \
+                and not self._scheduler.is_pending('verdict'):
+            self.refresh()
+
+    def index_deck(self):
+        """Indexes the next step of the deck for the current quiz mode between
+
+        events, until it is all indexed.
+
+        index_deck(Controller) --> void
+        """
+        if not self._session.prepare():
+            self._scheduler.call_later('index', 0.01, self.index_deck)
+
+    def check_assets(self):
+        """Waits for the asset check started by open_file, then decodes every
+
+        image that passed it a few at a time between events, keeping the
+        first WARM_IMAGES in the image cache, and reports any broken files.
+
+        check_assets(Controller) --> void
+        """
+        if not self._validator.done():
+            self._scheduler.call_later('assets', 0.25, self.check_assets)
+            return
+        report = self._validator.get_report()
+        self._broken.update(report.broken)
+        paths = [path for path in report.good_images if self._region(path) is None]
+        self._warm_images(report, paths, 0)
+
+    def load_atlas(self, deckname):
+        """Reads the index of the texture atlas built for deckname, if there
+
+        is one. Its sheets are decoded when a card on them is first shown.
+        Cards outside the atlas are decoded from their files.
+
+        load_atlas(Controller, str) --> void
+        """
+        self._atlas = None
+        filename = atlas_path(deckname)
+        if not os.path.exists(filename):
+            return
+        try:
+            atlas = AtlasIndex(filename)
+        except (IOError, OSError, ValueError, KeyError) as e:
+            import tkMessageBox
+            tkMessageBox.showwarning('Atlas Problems', u"{0}: {1}".format(filename, e))
+            return
+        self._atlas = atlas
+
+    def _region(self, path):
+        """Returns the atlas region of the image path, or None.
+
+        _region(Controller, str) --> tuple(int)
+        """
+        if self._atlas is None:
+            return None
+        return self._atlas.region(path)
+
+    def card_image(self, path):
+        """Returns the image to show for path: its region of the atlas
+
+        copied into the card image, or else the decoded file. Sheets go
+        through the image cache like card files, so only the recently used
+        ones stay decoded. A broken file shows the default image.
+
+        card_image(Controller, str) --> PhotoImage
+        """
+        if path in self._broken:
+            return self._c.default
+        region = self._region(path)
+        if region is not None:
+            sheet, x, y, width, height = region
+            try:
+                image = self._images.load(self._atlas.get_sheets()[sheet])
+            except (TclError, OSError):
+                #Fall back to the card's own file.
+                image = None
+            if image is not None:
+                card = self._c.card
+                with measure('atlas_copy'):
+                    card.blank()
+                    card.tk.call(card, 'copy', image, '-from', x, y, x + width, y + height)
+                return card
+        try:
+            return self._images.load(path)
+        except (TclError, OSError):
+            self._broken.add(path)
+            return self._c.default
+
+    def _warm_images(self, report, paths, start):
+        """Decodes a batch of paths from start on, the first WARM_IMAGES into
+
+        the image cache and the rest only to check them, and schedules the
+        rest, then shows the report if anything is broken.
+
+        _warm_images(Controller, AssetReport, list(str), int) --> void
+        """
+        for number in range(start, min(start + WARM_BATCH, len(paths))):
+            path = paths[number]
+            try:
+                if number < WARM_IMAGES:
+                    self._images.load(path)
+                else:
+                    PhotoImage(file=path)
+            except (TclError, OSError) as e:
+                report.add_broken(path, str(e))
+                self._broken.add(path)
+        start += WARM_BATCH
+        if start < len(paths):
+            self._scheduler.call_later('assets', 0, lambda: self._warm_images(report, paths, start))
+        elif report.broken:
+            import tkMessageBox
+            tkMessageBox.showwarning('Broken Assets', u"\n".join(report.get_lines()[:20]))
+
+    def filter_cards(self):
+        """Asks for a reading prefix or kanji and drills only the matching
+
+        cards. Kana select cards whose reading starts with them, anything
+        else cards containing every kanji given. An empty answer drills the
+        whole deck again.
+
+        filter_cards(Controller) --> void
+        """
+        if not self._items.length():
+            return
+        import tkSimpleDialog
+        query = tkSimpleDialog.askstring(
+            'Filter Cards', "Reading prefix (e.g. かん) or kanji (e.g. 金).\nLeave empty for all cards.")
+        if query is None:
+            return
+        query = query.strip()
+        if not query:
+            self._session.set_drill(None)
+        else:
+            if is_kana(query):
+                found = self._items.find_reading(query)
+            else:
+                found = self._items.find_kanji(query)
+            if not found:
+                import tkMessageBox
+                tkMessageBox.showinfo('Filter Cards', u"No cards match {0}.".format(query))
+                return
+            self._session.set_drill(found)
+        if self._playing:
+            self.refresh()
+
     def Play_Audio(self):
-        """Plays the audio file in the location of self._afile.
+        """Plays the audio file of the current card.
 
         Play_Audio(Controller) --> audiofile
         """
-        pygame.mixer.music.load("{}".format(self._afile))
-        pygame.mixer.music.play()
+        self._session.play_audio()
 
     def Entry_submit(self):
         """Calls the check_answer function on the buttons text.
 
-        Increments the self._acount var, and calls self.refresh.
+        The quiz session counts the attempt.
 
         AnswerOne(Controller) --> void
         """
         self.check_answer(self._entry.get().lower())
         self._entry.delete(0, END)
-        self._acount += 1
 
     def AnswerOne(self):
         """Calls the check_answer function on the buttons text.
 
-        Increments the self._acount var, and calls self.refresh.
+        The quiz session counts the attempt.
 
         AnswerOne(Controller) --> void
         """
         self.check_answer(self._button1.config('text')[-1])
-        self._acount += 1
 
     def AnswerTwo(self):
         """Calls the check_answer function on the buttons text.
 
-        Increments the self._acount var, and calls self.refresh.
+        The quiz session counts the attempt.
 
         AnswerTwo(Controller) --> void
         """
         self.check_answer(self._button2.config('text')[-1])
-        self._acount += 1
 
     def AnswerThree(self):
         """Calls the check_answer function on the buttons text.
 
-        Increments the self._acount var, and calls self.refresh.
+        The quiz session counts the attempt.
 
         AnswerThree(Controller) --> void
         """
         self.check_answer(self._button3.config('text')[-1])
-        self._acount += 1
 
+    @timed('check_answer')
     def check_answer(self, text):
-        """Checks if the text of the correct meaning is the same as that
+        """Grades text against the current card through the quiz session.
+
+        The session counts the attempt, plays the feedback clip and calls
+        show_verdict to update the label color and overlay.
 
-        of the button clicked by the user. If correct increments the correct
-        
-        answer count and changes the label color to green, otherwise changes
-        
-        the label color to grey.
-        
         check_answer(Controller, str) --> void
         """
-        self._time = 21
-        
-        if self._meikai:
-            if self._answer1 == text:
-                pygame.mixer.music.load('sound/seikai.mp3')
-                pygame.mixer.music.play()
-                self._c.true = PhotoImage(file='img/maru.gif')
-                self._marui = self._c.create_image(25, 25, image=self._c.true, anchor=NW)
-                self._ccount += 1
-                self._clabel.config(bg = 'green')
-            else:
-##                pygame.mixer.music.load(self._batsu[self._rnum])
-                pygame.mixer.music.load('sound/chigau.mp3')
-                pygame.mixer.music.play()
-                self._c.true = PhotoImage(file='img/batsu.gif')
-                self._marui = self._c.create_image(25, 25, image=self._c.true, anchor=NW)
-                self._clabel.config(bg = 'grey')
-        elif self._seikai:   
-            if self._answer1.lower() == text:
-                pygame.mixer.music.load('sound/seikai.mp3')
-                pygame.mixer.music.play()
-                self._c.true = PhotoImage(file='img/maru.gif')
-                self._marui = self._c.create_image(25, 25, image=self._c.true, anchor=NW)
-                self._ccount += 1
-                self._clabel.config(bg = 'green')
-            else:
-##                pygame.mixer.music.load(self._batsu[self._rnum])
-                pygame.mixer.music.load('sound/aho.mp3')
-                pygame.mixer.music.play()
-                self._c.true = PhotoImage(file='img/batsu.gif')
-                self._marui = self._c.create_image(25, 25, image=self._c.true, anchor=NW)
-                self._clabel.config(bg = 'grey')
-        elif self._reikai:
-            if self._hiraga == text:
-                pygame.mixer.music.load('sound/seikai.mp3')
-                pygame.mixer.music.play()
-                self._c.true = PhotoImage(file='img/maru.gif')
-                self._marui = self._c.create_image(25, 25, image=self._c.true, anchor=NW)
-                self._ccount += 1
-                self._clabel.config(bg = 'green')
-            else:
-##                pygame.mixer.music.load(str(self._batsu[self._rnum]))
-                pygame.mixer.music.load('sound/shikkari.mp3')
-                pygame.mixer.music.play()
-                self._c.true = PhotoImage(file='img/batsu.gif')
-                self._marui = self._c.create_image(25, 25, image=self._c.true, anchor=NW)
-                self._clabel.config(bg = 'grey')
+        self._countdown.stop()
+        self._session.submit(text)
         self.marutick()
+
+    @timed('canvas_update')
+    def show_verdict(self, question, correct):
+        """Shows the maru or batsu overlay and colors the count label
+
+        green for a correct answer or grey otherwise.
+
+        show_verdict(Controller, Question, bool) --> void
+        """
+        if correct:
+            self._c.true = self._c.maru
+            self._clabel.config(bg = 'green')
+        else:
+            self._c.true = self._c.batsu
+            self._clabel.config(bg = 'grey')
+        self._c.itemconfig(self._marui, image=self._c.true)
                 
     def refresh(self):
-        """Updates all buttons and labels with values from the JSON file dict.
+        """Asks the quiz session for the next question, which calls back into
 
-        Uses the random module to randomize the Kanji and Meanings displayed.
+        show_question to update the buttons and labels.
 
         refresh(Controller) --> void
         """
         
         #updates the label displaying user attempt and correct answer count 
-        self._clabel.config(text="Attempts: {0},  Correct: {1}/30".format(self._acount, self._ccount))
-        self._time = 21
-        self._marutime = 2
-        
-        #Turns the timer canvas white.
+        self._clabel.config(text="Attempts: {0},  Correct: {1}/30".format(
+            self._session.get_attempts(), self._session.get_correct()))
+        #Turns the timer canvas white and restarts the countdown.
         self._timer.config(bg = 'white')
-        
-        #Assigns a random card from the Cardlist to kj_card
-        num = random.randint(0, self._items.length()-1)
-        kj_card = self._items.get_index(num)
-        
-        while kj_card in self._displayed:
-            num = random.randint(0, self._items.length()-1)
-            kj_card = self._items.get_index(num)
+        self._countdown.restart()
 
-        self._displayed.append(kj_card)
-        if len(self._displayed) == 30:
-            self._displayed = []
-        
-        #Configure the Kanji label and Correct Answer button
-        self._label.config(text=kj_card.get_kanji())
-        if self._meikai or self._seikai:
-            self._libel.config(text=kj_card.get_hiragana())
-        self._afile = kj_card.get_audio()
-        self._c.delete(self._item)
-        self._c.current = PhotoImage(file=kj_card.get_image())
-        self._c.create_image(25, 25, image=self._c.current, anchor=NW)
-        self._answer1 = kj_card.get_meaning()
-        self._hiraga = kj_card.get_hiragana()
-
-        self._c.true = PhotoImage(file='img/blank.gif')
-        self._marui = self._c.create_image(25, 25, image=self._c.true, anchor=NW)
-
-        #Configure the Incorrect Answer buttons
-        bnum = random.randint(0,2)
-        
-        nu = random.randint(0, self._items.length()-1)
-        k_card = self._items.get_index(nu)
-        self._answer2 = k_card.get_meaning()
-        
-        n = random.randint(0, self._items.length()-1)
-        kcard = self._items.get_index(n)
-        self._answer3 = kcard.get_meaning()
-
-        #Randomly configuring the Buttons to be 1 of 3
-        alist = [self._answer1, self._answer2, self._answer3]
-        self._button1.config(text=alist[bnum])
-        alist.pop(bnum)
-        rnum = random.randint(0,1)
-        self._button2.config(text=alist[rnum])
-        alist.pop(rnum)
-        self._button3.config(text=alist[0])
-
-        #Set up a random audio file for incorrect answers.
-        self._rnum = random.randint(0,2)
-        self._shikkari = 'sound/shikkari.mp3'
-        self._chigau = 'sound/chigau.mp3'
-        self._aho = 'sound/aho.mp3'
-        self._batsu = [self._shikkari, self._chigau, self._batsu]
+        self._session.next_question()
 
         #Once correct answers reach 30, open tkMessagebox, if OK,
         #reset attempts, correct answers to 0
-        if self._ccount == 30:
+        if self._session.is_complete():
+            import tkMessageBox
             ans = tkMessageBox.askokcancel(
                 'Deck Complete', "Congratulations! You've completed this deck. Start Again?"
                 )
             if ans:
-                self._ccount = 0
-                self._acount = 0
+                self._session.reset()
                 self.refresh()
 
+    @timed('canvas_update')
+    def show_question(self, question):
+        """Updates all buttons and labels with the card of question.
+
+        show_question(Controller, Question) --> void
+        """
+        kj_card = question.card
+
+        #Configure the Kanji label and the card image
+        self._label.config(text=kj_card.get_kanji())
+        if self._session.get_mode() != REIKAI:
+            self._libel.config(text=kj_card.get_hiragana())
+        self._c.current = self.card_image(kj_card.get_image())
+        self._c.itemconfig(self._item, image=self._c.current)
+
+        self._c.true = self._c.blank
+        self._c.itemconfig(self._marui, image=self._c.true)
+
+        if DEBUG:
+            self._master.title("Meikaichan 1.0 [canvas items: {0}]".format(self.canvas_items()))
+
+        #Configure the answer buttons in the order chosen by the session
+        if question.choices:
+            self._button1.config(text=question.choices[0])
+            self._button2.config(text=question.choices[1])
+            self._button3.config(text=question.choices[2])
+
+    def canvas_items(self):
+        """Returns the number of items live on the card canvas.
+
+        canvas_items(Controller) --> int
+        """
+        return len(self._c.find_all())
+
     def save(self):
-##      placeholder for later versions
-        pass
+        """Saves the review schedule of the open deck, so the next session
+
+        carries on where this one stopped.
+
+        save(Controller) --> void
+        """
+        if self._deckfile:
+            self._schedule.save(schedule_path(self._deckfile))
+
+    def toggle_timing(self):
+        """Turns stage timing on or off. The timings are written to
+
+        instrument.TIMINGS_FILE on exit.
+
+        toggle_timing(Controller) --> void
+        """
+        import tkMessageBox
+        if instrument.toggle():
+            tkMessageBox.showinfo('Timing', "Timing on.")
+        else:
+            tkMessageBox.showinfo('Timing', "Timing off.\n\n" + INSTRUMENTS.report())
     
     def close(self):
         """Asks the user to confirm whether they would like to exit.
 
+        The review schedule is saved, the review log closed and any stage
+        timings written before exiting.
+
         close(Controller) --> destroy
         """
+        import tkMessageBox
         ans = tkMessageBox.askokcancel('Verify exit', "Really exit?")
-        if ans: self._master.destroy()
+        if ans:
+            #Exit even if the schedule or timings cannot be written.
+            try:
+                self.save()
+            except EnvironmentError as e:
+                sys.stderr.write("Schedule not saved: {0}\n".format(e))
+            if self._log is not None:
+                self._log.close()
+            try:
+                INSTRUMENTS.dump()
+            except EnvironmentError as e:
+                sys.stderr.write("Timings not saved: {0}\n".format(e))
+            self._master.destroy()
 
     def quit(self):
         """Asks the user to confirm whether they would like to exit.
 
+        The review schedule is saved, the review log closed and any stage
+        timings written before exiting.
+
         close(Controller) --> destroy
         """
+        import tkMessageBox
         ans = tkMessageBox.askokcancel('Verify exit', "Really exit?")
-        if ans: self._master.destroy()
+        if ans:
+            #Exit even if the schedule or timings cannot be written.
+            try:
+                self.save()
+            except EnvironmentError as e:
+                sys.stderr.write("Schedule not saved: {0}\n".format(e))
+            if self._log is not None:
+                self._log.close()
+            try:
+                INSTRUMENTS.dump()
+            except EnvironmentError as e:
+                sys.stderr.write("Timings not saved: {0}\n".format(e))
+            self._master.destroy()
 
     def meikai(self):
-        """Sets the Meikai mode flag to True, gives it a custom title. Calls hide_all.
+        """Switches the quiz session to Meikai mode, gives it a custom title. Calls hide_all.
 
         meikai(Controller) --> void
         """
-        self._meikai = True
-        self._seikai = False
-        self._reikai = False
+        self._session.set_mode(MEIKAI)
+        self._scheduler.call_later('index', 0.05, self.index_deck)
         self._label.config(text="めいかいモード\nMeikai Mode:\nChoose the Kanji meaning")
         self.hide_all()
         
     def seikai(self):
-        """Sets the Seikai mode flag to True, gives it a custom title. Calls hide_all.
+        """Switches the quiz session to Seikai mode, gives it a custom title. Calls hide_all.
 
         seikai(Controller) --> void
         """
-        self._meikai = False
-        self._seikai = True
-        self._reikai = False
+        self._session.set_mode(SEIKAI)
         self._label.config(text="せいかいモード\nSeikai Mode:\nWrite the Kanji meaning")
         self.hide_all()
 
     def reikai(self):
-        """Sets the Reikai mode flag to True, gives it a custom title. Calls hide_all.
+        """Switches the quiz session to Reikai mode, gives it a custom title. Calls hide_all.
 
         reikai(Controller) --> void
         """
-        self._meikai = False
-        self._seikai = False
-        self._reikai = True
+        self._session.set_mode(REIKAI)
         self._label.config(text="れいかいモード\nReikai Mode:\nWrite the Hiragana before the time runs out")
         self.hide_all()
 
@@ -586,6 +831,9 @@ class Controller(object):
 
         hide_all(Controller) -- void
         """
+        self._playing = False
+        self._countdown.stop()
+        self._scheduler.cancel('verdict')
         self._timer.pack_forget()
         self._entry.pack_forget()
         self._submit.pack_forget()
@@ -593,12 +841,10 @@ class Controller(object):
         self._button2.pack_forget()
         self._button3.pack_forget()
         self._playaudio.pack_forget()
-        self._acount = 0
-        self._ccount = 0
-        self._c.true = PhotoImage(file='img/blank.gif')
-        self._c.create_image(25, 25, image=self._c.true, anchor=NW)
-        self._c.current = PhotoImage(file='img/default.gif')
-        self._c.create_image(25, 25, image=self._c.current, anchor=NW)
+        self._c.true = self._c.blank
+        self._c.itemconfig(self._marui, image=self._c.true)
+        self._c.current = self._c.default
+        self._c.itemconfig(self._item, image=self._c.current)
         self._clabel.config(text="", bg=None)
         self._libel.config(text="", bg=None)
         self.refresh
@@ -609,10 +855,24 @@ class Meikaiapp(object):
         self.controller = Controller(master)
 
 def main():
-        #run the Meikaiapp
+        #run the Meikaiapp, timing each startup stage
+        STARTUP.mark('import')
         root = Tk()
+        STARTUP.mark('tk init')
         app = Meikaiapp(root)
-        root.mainloop()
+        STARTUP.mark('controller')
+        root.update()
+        STARTUP.mark('first paint')
+        if DEBUG or '--startup-report' in sys.argv[1:]:
+            sys.stderr.write("Startup\n{0}\n".format(STARTUP))
+        #--timing times the hot path from the start, --profile runs the
+        #whole session under cProfile.
+        if '--timing' in sys.argv[1:]:
+            instrument.enable()
+        if '--profile' in sys.argv[1:]:
+            instrument.profile(root.mainloop)
+        else:
+            root.mainloop()
 
 if __name__ == '__main__':
     main()
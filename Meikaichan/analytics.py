@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+"""
+Review analytics for Meikaichan.
+
+Loads the review log (see reviewlog.py) into NumPy arrays and computes, with
+bulk array operations only, the accuracy of every card and mode, response
+time percentiles, and which wrong meanings are picked for which card in
+Meikai mode. Requires NumPy.
+
+Usage:
+
+    python analytics.py [--db reviews.db] [--top 20]
+"""
+
+import os
+import sys
+import sqlite3
+import argparse
+try:
+    from urllib import pathname2url
+except ImportError:
+    from urllib.request import pathname2url
+
+import numpy as np
+
+from reviewlog import REVIEW_DB
+from quiz import MEIKAI
+
+PERCENTILES = (50, 90, 99)
+
+class Reviews(object):
+
+    def __init__(self, cards, modes, card, mode, answer, correct, response_ms, day):
+        """Initializes a columnar view of the review log.
+
+        cards and modes are the distinct card meanings and mode names; card,
+        mode and answer are arrays of codes into them (answer is -1 where the
+        answer given is not a card meaning), the rest one value per review.
+
+        __init__(Reviews, ndarray, ndarray, ndarray...) --> void
+        """
+        self.cards = cards
+        self.modes = modes
+        self.card = card
+        self.mode = mode
+        self.answer = answer
+        self.correct = correct
+        self.response_ms = response_ms
+        self.day = day
+
+    def __len__(self):
+        """Returns the number of reviews.
+
+        __len__(Reviews) --> int
+        """
+        return len(self.card)
+
+def open_readonly(filename):
+    """Opens the database filename read-only, so a missing file is not
+
+    created. Raises IOError if there is no file or it holds no review log.
+
+    open_readonly(str) --> sqlite3.Connection
+    """
+    if not os.path.isfile(filename):
+        raise IOError("no review log at {0}".format(filename))
+    try:
+        db = sqlite3.connect('file:{0}?mode=ro'.format(pathname2url(os.path.abspath(filename))),
+                             uri=True)
+    except TypeError:
+        #Python 2 has no URI filenames; the file is known to exist.
+        db = sqlite3.connect(filename)
+    found = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'reviews'").fetchone()
+    if found is None:
+        db.close()
+        raise IOError("{0} holds no review log".format(filename))
+    return db
+
+def load_reviews(filename=REVIEW_DB):
+    """Reads every review in the database filename into a Reviews.
+
+    Cards and modes are numbered by SQLite, so only integers cross into
+    Python and NumPy. Meanings picked in Meikai mode are numbered as cards
+    even if they were never asked themselves; the empty answer logged when
+    time runs out is not.
+
+    load_reviews(str) --> Reviews
+    """
+    db = open_readonly(filename)
+    try:
+        db.executescript("""
+            CREATE TEMP TABLE card_codes (code INTEGER PRIMARY KEY, card TEXT UNIQUE);
+            CREATE TEMP TABLE mode_codes (code INTEGER PRIMARY KEY, mode TEXT UNIQUE);
+            INSERT INTO mode_codes (mode) SELECT DISTINCT mode FROM reviews ORDER BY mode;
+            """)
+        db.execute("""
+            INSERT INTO card_codes (card)
+            SELECT card FROM reviews UNION SELECT answer FROM reviews WHERE mode = ? AND answer != ''
+            ORDER BY 1
+            """, (MEIKAI,))
+        cards = np.array([row[0] for row in db.execute("SELECT card FROM card_codes ORDER BY code")],
+                         dtype=object)
+        modes = np.array([row[0] for row in db.execute("SELECT mode FROM mode_codes ORDER BY code")],
+                         dtype=object)
+        #Answers that are meanings of cards get that card's code, others,
+        #including the empty answer of a timeout, -1.
+        rows = db.execute("""
+            SELECT c.code - 1, m.code - 1, COALESCE(a.code, 0) - 1,
+                   r.correct, r.response_ms, r.day
+            FROM reviews r
+            JOIN card_codes c ON c.card = r.card
+            JOIN mode_codes m ON m.mode = r.mode
+            LEFT JOIN card_codes a ON a.card = r.answer AND r.answer != ''
+            """).fetchall()
+    finally:
+        db.close()
+    columns = np.array(rows, dtype=np.int64).reshape(-1, 6)
+    return Reviews(cards, modes, columns[:, 0], columns[:, 1], columns[:, 2],
+                   columns[:, 3].astype(bool), columns[:, 4], columns[:, 5])
+
+def accuracy(codes, correct, size):
+    """Returns the attempts, correct answers and accuracy of each of size
+
+    groups, given the group code and correctness of every review.
+
+    accuracy(ndarray, ndarray, int) --> (ndarray, ndarray, ndarray)
+    """
+    attempts = np.bincount(codes, minlength=size)
+    right = np.bincount(codes, weights=correct, minlength=size).astype(np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rate = np.where(attempts > 0, right / np.maximum(attempts, 1).astype(float), np.nan)
+    return attempts, right, rate
+
+def grouped_percentiles(codes, values, size, percentiles=PERCENTILES):
+    """Returns a size x len(percentiles) array of the percentiles of values
+
+    within each group, using the nearest-rank method; NaN for empty groups.
+
+    grouped_percentiles(ndarray, ndarray, int, tuple(int)) --> ndarray
+    """
+    result = np.full((size, len(percentiles)), np.nan)
+    if not len(codes):
+        return result
+    order = np.lexsort((values, codes))
+    counts = np.bincount(codes, minlength=size)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    present = counts > 0
+    sorted_values = values[order]
+    for column, percentile in enumerate(percentiles):
+        rank = np.ceil(percentile / 100.0 * counts).astype(np.int64) - 1
+        rank = np.clip(rank, 0, np.maximum(counts - 1, 0))
+        result[present, column] = sorted_values[(starts + rank)[present]]
+    return result
+
+def confusion(reviews):
+    """Returns the Meikai confusions as arrays (card, answer, count), sorted
+
+    by count, most frequent first: how often the meaning of card answer was
+    picked when card was asked. Timeouts are not picks and are left out.
+
+    confusion(Reviews) --> (ndarray, ndarray, ndarray)
+    """
+    meikai = np.flatnonzero(reviews.modes == MEIKAI)
+    if not len(meikai):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    mask = (reviews.mode == meikai[0]) & ~reviews.correct & (reviews.answer >= 0)
+    size = len(reviews.cards)
+    pairs = reviews.card[mask].astype(np.int64) * size + reviews.answer[mask]
+    pairs, counts = np.unique(pairs, return_counts=True)
+    order = np.argsort(-counts, kind='stable')
+    return pairs[order] // size, pairs[order] % size, counts[order]
+
+def confusion_matrix(reviews):
+    """Returns the Meikai confusion matrix in coordinate form, as arrays
+
+    (card, answer, count) sorted by card and then answer, with only the
+    pairs that occurred, so its size does not grow with the square of the
+    deck. scipy.sparse.coo_matrix((count, (card, answer))) makes it sparse.
+
+    confusion_matrix(Reviews) --> (ndarray, ndarray, ndarray)
+    """
+    card, answer, counts = confusion(reviews)
+    order = np.lexsort((answer, card))
+    return card[order], answer[order], counts[order]
+
+def report(reviews, top=20, out=sys.stdout):
+    """Writes the accuracy, response time and confusion summary to out.
+
+    report(Reviews, int, file) --> void
+    """
+    out.write("Reviews: {0}\n".format(len(reviews)))
+    if not len(reviews):
+        return
+
+    out.write("\nBy mode\n")
+    attempts, right, rate = accuracy(reviews.mode, reviews.correct, len(reviews.modes))
+    times = grouped_percentiles(reviews.mode, reviews.response_ms, len(reviews.modes))
+    header = "  ".join("p{0}".format(p) for p in PERCENTILES)
+    out.write("{0:<12}{1:>9}{2:>9}{3:>8}  {4}\n".format("mode", "attempts", "correct", "rate", header))
+    for code, name in enumerate(reviews.modes):
+        out.write("{0:<12}{1:>9}{2:>9}{3:>8.1%}  {4}\n".format(
+            name, attempts[code], right[code], rate[code],
+            "  ".join("{0:.0f}ms".format(t) for t in times[code])))
+
+    out.write("\nHardest cards\n")
+    attempts, right, rate = accuracy(reviews.card, reviews.correct, len(reviews.cards))
+    times = grouped_percentiles(reviews.card, reviews.response_ms, len(reviews.cards))
+    #Meanings only ever picked as answers have no attempts of their own.
+    order = np.lexsort((-attempts, rate))
+    order = order[attempts[order] > 0][:top]
+    out.write("{0:<24}{1:>9}{2:>8}{3:>9}\n".format("card", "attempts", "rate", "p50"))
+    for code in order:
+        out.write(u"{0:<24}{1:>9}{2:>8.1%}{3:>7.0f}ms\n".format(
+            reviews.cards[code], attempts[code], rate[code], times[code, 0]))
+
+    out.write("\nMost confused meanings (Meikai)\n")
+    card, answer, counts = confusion(reviews)
+    for asked, picked, count in zip(card[:top], answer[:top], counts[:top]):
+        out.write(u"{0:<24} picked as {1:<24}{2:>6}\n".format(
+            reviews.cards[asked], reviews.cards[picked], count))
+
+def main(argv=None):
+    """Prints an analytics report of the review log.
+
+    main(list(str)) --> int
+    """
+    parser = argparse.ArgumentParser(description="Summarise the Meikaichan review log.")
+    parser.add_argument('--db', default=REVIEW_DB, help="review database to read")
+    parser.add_argument('--top', type=int, default=20, help="rows to show per table")
+    args = parser.parse_args(argv)
+    try:
+        reviews = load_reviews(args.db)
+    except (IOError, sqlite3.Error) as e:
+        sys.stderr.write("analytics: {0}\n".format(e))
+        return 1
+    report(reviews, args.top)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+"""
+Typed answer matching for Meikaichan.
+
+Seikai and Reikai answers are compared in a canonical form: NFKC folds
+full-width letters and half-width kana, case and runs of whitespace are
+folded, and katakana is read as hiragana. A meaning may list synonyms
+separated by ";", "/" or ",", any of which is accepted. Answers of
+TYPO_MIN_LENGTH characters or more may also be one edit away. The canonical
+forms of each card are computed once, when the card is indexed, so grading
+only normalizes the typed text.
+"""
+
+import re
+import unicodedata
+
+#Answers at least this long may be one insertion, deletion or substitution off.
+TYPO_MIN_LENGTH = 4
+TYPO_LIMIT = 1
+
+SYNONYM_SEPARATORS = re.compile(u'[;/,]')
+
+#Katakana ァ..ヶ map onto hiragana ぁ..ゖ.
+KATAKANA_TO_HIRAGANA = dict((code, code - 0x60) for code in range(0x30A1, 0x30F7))
+
+def normalize(text):
+    """Returns the canonical form of text used for comparing answers.
+
+    normalize(str) --> str
+    """
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = text.translate(KATAKANA_TO_HIRAGANA)
+    return u' '.join(text.split())
+
+def synonyms(meaning):
+    """Returns the canonical forms accepted for meaning: the whole meaning
+
+    and each synonym it lists.
+
+    synonyms(str) --> tuple(str)
+    """
+    forms = [normalize(meaning)]
+    for part in SYNONYM_SEPARATORS.split(meaning):
+        form = normalize(part)
+        if form and form not in forms:
+            forms.append(form)
+    return tuple(forms)
+
+def within_distance(a, b, limit):
+    """Returns True if the edit distance between a and b is at most limit.
+
+    A limit of one is checked by comparing what is left after the common
+    prefix. Otherwise only the diagonal band of width 2 * limit + 1 is
+    computed, and the comparison stops as soon as every cell in a row
+    exceeds limit.
+
+    within_distance(str, str, int) --> bool
+    """
+    if abs(len(a) - len(b)) > limit:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    if limit == 1:
+        i = 0
+        while i < len(a) and a[i] == b[i]:
+            i += 1
+        if len(a) == len(b):
+            return a[i + 1:] == b[i + 1:]
+        return a[i:] == b[i + 1:]
+    big = limit + 1
+    previous = [j if j <= limit else big for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        low = max(1, i - limit)
+        high = min(len(b), i + limit)
+        current = [big] * (len(b) + 1)
+        current[0] = i if i <= limit else big
+        best = current[0]
+        char = a[i - 1]
+        for j in range(low, high + 1):
+            cost = previous[j - 1] + (char != b[j - 1])
+            cost = min(cost, previous[j] + 1, current[j - 1] + 1)
+            current[j] = cost if cost <= limit else big
+            if current[j] < best:
+                best = current[j]
+        if best > limit:
+            return False
+        previous = current
+    return previous[len(b)] <= limit
+
+def matches(typed, forms):
+    """Returns True if the canonical answer typed matches one of forms,
+
+    exactly or, for long enough answers, within one typo.
+
+    matches(str, tuple(str)) --> bool
+    """
+    if typed in forms:
+        return True
+    if len(typed) < TYPO_MIN_LENGTH:
+        return False
+    for form in forms:
+        if len(form) >= TYPO_MIN_LENGTH and within_distance(typed, form, TYPO_LIMIT):
+            return True
+    return False
+
+class AnswerIndex(object):
+
+    def __init__(self):
+        """Initializes an empty index of canonical answers.
+
+        Cards may be indexed all at once with extend, or one at a time with
+        add as they are first asked.
+
+        __init__(AnswerIndex) --> void
+        """
+        self._meanings = []
+        self._readings = []
+        self._next = 0
+
+    def __len__(self):
+        """Returns the number of cards the index has room for.
+
+        __len__(AnswerIndex) --> int
+        """
+        return len(self._meanings)
+
+    def has(self, index):
+        """Returns True if the answers of the card at index are indexed.
+
+        has(AnswerIndex, int) --> bool
+        """
+        return index < len(self._meanings) and self._meanings[index] is not None
+
+    def add(self, index, card):
+        """Computes the canonical answers of card, found at index.
+
+        add(AnswerIndex, int, Kanjicard) --> void
+        """
+        while len(self._meanings) <= index:
+            self._meanings.append(None)
+            self._readings.append(None)
+        self._meanings[index] = synonyms(card.get_meaning())
+        self._readings[index] = (normalize(card.get_hiragana()),)
+
+    def extend(self, cardlist, limit=None):
+        """Indexes the cards of cardlist not yet indexed, at most limit of
+
+        them if given. Returns True once every card is indexed.
+
+        extend(AnswerIndex, Cardlist, int) --> bool
+        """
+        length = cardlist.length()
+        stop = length if limit is None else min(length, self._next + limit)
+        for index in range(self._next, stop):
+            if not self.has(index):
+                self.add(index, cardlist.get_index(index))
+        self._next = max(self._next, stop)
+        return self._next >= length
+
+    def remove(self, index, card):
+        """Forgets the answers of card, found at index.
+
+        remove(AnswerIndex, int, Kanjicard) --> void
+        """
+        if index < len(self._meanings):
+            self._meanings[index] = None
+            self._readings[index] = None
+
+    def resize(self, size):
+        """Forgets the cards from size on, after they have been removed.
+
+        resize(AnswerIndex, int) --> void
+        """
+        del self._meanings[size:]
+        del self._readings[size:]
+        self._next = min(self._next, size)
+
+    def check_meaning(self, index, text):
+        """Returns True if text is an accepted meaning of the card at index.
+
+        check_meaning(AnswerIndex, int, str) --> bool
+        """
+        return matches(normalize(text), self._meanings[index])
+
+    def check_reading(self, index, text):
+        """Returns True if text is the reading of the card at index.
+
+        check_reading(AnswerIndex, int, str) --> bool
+        """
+        return matches(normalize(text), self._readings[index])
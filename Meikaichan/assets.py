@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+
+"""
+Asset caches for Meikaichan.
+
+Card images and audio clips are decoded once and kept in memory, bounded by
+an approximate size in bytes and evicted least recently used first.
+
+AssetValidator checks every distinct image and audio file of a deck on a
+thread pool when the deck is opened, so missing or corrupt files are
+reported up front rather than when their card comes up.
+"""
+
+import os
+import struct
+import threading
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+#Default memory bounds of the caches, in bytes.
+IMAGE_CACHE_BYTES = 64 * 1024 * 1024
+AUDIO_CACHE_BYTES = 64 * 1024 * 1024
+
+#Threads checking asset files.
+VALIDATOR_THREADS = 8
+
+class LRUCache(object):
+
+    def __init__(self, max_bytes):
+        """Initializes an empty cache holding at most max_bytes of values.
+
+        The cache is safe to use from several threads.
+
+        __init__(LRUCache, int) --> void
+        """
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value cached under key and marks it recently used,
+
+        or None on a miss.
+
+        get(LRUCache, key) --> value
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries[key] = entry
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Caches value of size bytes under key, evicting least recently
+
+        used values until the cache fits in its bound again. The newest
+        value is always kept, even if it alone exceeds the bound.
+
+        put(LRUCache, key, value, int) --> void
+        """
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self._max_bytes and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def discard(self, key):
+        """Removes the value cached under key, if any.
+
+        discard(LRUCache, key) --> void
+        """
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+    def clear(self):
+        """Removes every cached value.
+
+        clear(LRUCache) --> void
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self):
+        """Returns the hit and miss counts, number of entries and bytes held.
+
+        get_stats(LRUCache) --> dict
+        """
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses,
+                    'entries': len(self._entries), 'bytes': self._bytes}
+
+class FileCache(LRUCache):
+
+    def __init__(self, loader, sizer, max_bytes):
+        """Initializes a cache of files decoded by loader.
+
+        sizer returns the bytes a decoded value occupies.
+
+        __init__(FileCache, callable, callable, int) --> void
+        """
+        LRUCache.__init__(self, max_bytes)
+        self._loader = loader
+        self._sizer = sizer
+        self._mtimes = {}
+
+    def load(self, path):
+        """Returns the decoded file at path, decoding it only if it is not
+
+        cached or the file has been modified since it was cached.
+
+        load(FileCache, str) --> value
+        """
+        mtime = os.path.getmtime(path)
+        value = self.get((path, mtime))
+        if value is None:
+            value = self._loader(path)
+            stale = self._mtimes.get(path)
+            if stale is not None:
+                self.discard((path, stale))
+            self._mtimes[path] = mtime
+            self.put((path, mtime), value, self._sizer(value))
+        return value
+
+class ImageCache(FileCache):
+
+    def __init__(self, loader, sizer, max_bytes=IMAGE_CACHE_BYTES):
+        """Initializes an image cache.
+
+        loader decodes an image from a path and sizer returns the bytes a
+        decoded image occupies, e.g. PhotoImage and width * height * 4.
+
+        __init__(ImageCache, callable, callable, int) --> void
+        """
+        FileCache.__init__(self, loader, sizer, max_bytes)
+
+class AudioBank(FileCache):
+
+    def __init__(self, loader, sizer, max_bytes=AUDIO_CACHE_BYTES):
+        """Initializes an audio bank.
+
+        loader decodes a clip from a path, e.g. pygame.mixer.Sound, and sizer
+        returns the bytes a decoded clip occupies.
+
+        __init__(AudioBank, callable, callable, int) --> void
+        """
+        FileCache.__init__(self, loader, sizer, max_bytes)
+        self._queue = Queue()
+        self._worker = None
+
+    def prefetch(self, path):
+        """Decodes the clip at path on a background thread so a later load
+
+        finds it cached. Failures are left for load to report.
+
+        prefetch(AudioBank, str) --> void
+        """
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._prefetch_loop)
+            self._worker.daemon = True
+            self._worker.start()
+        self._queue.put(path)
+
+    def _prefetch_loop(self):
+        """Decodes the paths queued by prefetch, forever.
+
+        _prefetch_loop(AudioBank) --> void
+        """
+        while True:
+            path = self._queue.get()
+            try:
+                self.load(path)
+            except Exception:
+                pass
+
+def check_image(path):
+    """Reads the image at path and checks it is a complete GIF or PNG.
+
+    Returns None if it is, or a description of the problem. Damage inside
+    the file is only found by decoding it, which the app does with Tk.
+
+    check_image(str) --> str
+    """
+    try:
+        with open(path, 'rb') as fd:
+            data = fd.read()
+    except (IOError, OSError) as e:
+        return e.strerror or str(e)
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        width, height = struct.unpack('<HH', data[6:10])
+        if data[-1:] != b';':
+            return "truncated GIF"
+    elif data[:8] == b'\x89PNG\r\n\x1a\n':
+        width, height = struct.unpack('>II', data[16:24])
+        if b'IEND' not in data[-12:]:
+            return "truncated PNG"
+    else:
+        return "not a GIF or PNG image"
+    if not width or not height:
+        return "empty image"
+    return None
+
+def check_audio(path):
+    """Reads the audio file at path and checks it looks like MP3, WAV or Ogg.
+
+    Returns None if it does, or a description of the problem.
+
+    check_audio(str) --> str
+    """
+    try:
+        with open(path, 'rb') as fd:
+            data = fd.read()
+    except (IOError, OSError) as e:
+        return e.strerror or str(e)
+    head = bytearray(data[:4])
+    if data[:3] == b'ID3' or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return None
+    if (data[:4] == b'RIFF' and data[8:12] == b'WAVE') or data[:4] == b'OggS':
+        return None
+    return "not an MP3, WAV or Ogg file"
+
+class AssetReport(object):
+
+    def __init__(self):
+        """Initializes an empty report of an asset check.
+
+        broken maps each broken path to (problem, meanings of the cards
+        using it); good_images lists the images that passed.
+
+        __init__(AssetReport) --> void
+        """
+        self.images = 0
+        self.audio = 0
+        self.broken = {}
+        self.good_images = []
+
+    def add_broken(self, path, problem, meanings=()):
+        """Records that path is broken.
+
+        add_broken(AssetReport, str, str, list(str)) --> void
+        """
+        self.broken[path] = (problem, list(meanings))
+
+    def get_lines(self):
+        """Returns a summary of the check, one broken file per line.
+
+        get_lines(AssetReport) --> list(str)
+        """
+        lines = [u"Checked {0} images and {1} audio files, {2} broken".format(
+            self.images, self.audio, len(self.broken))]
+        for path in sorted(self.broken):
+            problem, meanings = self.broken[path]
+            if meanings:
+                lines.append(u"{0}: {1} (used by {2})".format(path, problem, u", ".join(meanings[:3]) +
+                                                              (u", ..." if len(meanings) > 3 else u"")))
+            else:
+                lines.append(u"{0}: {1}".format(path, problem))
+        return lines
+
+    def __str__(self):
+        """Returns the lines of get_lines as one string, UTF-8 encoded on
+
+        Python 2.
+
+        __str__(AssetReport) --> str
+        """
+        text = u"\n".join(self.get_lines())
+        return text if str is not bytes else text.encode('utf-8')
+
+class AssetValidator(object):
+
+    def __init__(self, cardlist, warm_audio=None, threads=VALIDATOR_THREADS):
+        """Checks the assets of cardlist in the background, starting now.
+
+        warm_audio, if given, is called with each good audio path from a
+        pool thread, e.g. to decode it into an AudioBank. The cards are
+        checked as they are now; later changes to cardlist are not seen.
+
+        __init__(AssetValidator, Cardlist, callable, int) --> void
+        """
+        self._cards = cardlist.snapshot()
+        self._warm_audio = warm_audio
+        self._threads = threads
+        self._report = None
+        self._done = threading.Event()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def done(self):
+        """Returns True once every asset has been checked.
+
+        done(AssetValidator) --> bool
+        """
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Waits for the check to finish and returns its report, or None on
+
+        timeout.
+
+        wait(AssetValidator, float) --> AssetReport
+        """
+        self._done.wait(timeout)
+        return self._report
+
+    def get_report(self):
+        """Returns the report once the check has finished, otherwise None.
+
+        get_report(AssetValidator) --> AssetReport
+        """
+        return self._report
+
+    def _check(self, job):
+        """Checks one asset for the pool. job is (kind, path).
+
+        _check(AssetValidator, tuple) --> str
+        """
+        kind, path = job
+        if kind == 'image':
+            return check_image(path)
+        problem = check_audio(path)
+        if problem is None and self._warm_audio is not None:
+            try:
+                self._warm_audio(path)
+            except Exception:
+                pass
+        return problem
+
+    def _run(self):
+        """Collects the distinct asset paths and checks them on the pool.
+
+        _run(AssetValidator) --> void
+        """
+        report = AssetReport()
+        try:
+            users = {}
+            cards = self._cards
+            for index in range(len(cards)):
+                card = cards.get(index)
+                for job in (('image', card.get_image()), ('audio', card.get_audio())):
+                    users.setdefault(job, []).append(card.get_meaning())
+            jobs = sorted(users)
+            report.images = sum(1 for kind, _ in jobs if kind == 'image')
+            report.audio = len(jobs) - report.images
+            pool = ThreadPool(self._threads)
+            try:
+                for job, problem in zip(jobs, pool.imap(self._check, jobs, 16)):
+                    if problem is not None:
+                        report.add_broken(job[1], problem, users[job])
+                    elif job[0] == 'image':
+                        report.good_images.append(job[1])
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            self._cards.close()
+            self._report = report
+            self._done.set()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+Texture atlases for Meikaichan.
+
+The build step reads a deck, resizes every distinct image it references to
+the card size, packs them into a grid on one or more sheets and writes an
+index next to the deck:
+
+    Kanji 6.atlas.json     {"cell": [300, 300], "sheets": ["Kanji 6.atlas-0.png"],
+                            "regions": {"img/fire.gif": [0, 0, 0, 300, 300], ...},
+                            "cards": {"Fire": "img/fire.gif", ...}}
+    Kanji 6.atlas-0.png    the first sheet
+
+The app loads the sheets once when the deck is opened and shows a card by
+copying its region out of a sheet, so no image file is read or decoded per
+question. Building requires PIL; Tk 8.5 cannot read PNG, so build with
+--format gif for it.
+
+Usage:
+
+    python atlas.py "Kanji 6.json" [--cells 8] [--format png]
+"""
+
+import os
+import sys
+import json
+import argparse
+
+#Size of a card image on the canvas, and cells per sheet side.
+CELL_WIDTH = 300
+CELL_HEIGHT = 300
+SHEET_CELLS = 8
+
+ATLAS_SUFFIX = '.atlas.json'
+
+def atlas_path(deckname):
+    """Returns the path of the atlas index built for the deck deckname.
+
+    atlas_path(str) --> str
+    """
+    return os.path.splitext(deckname)[0] + ATLAS_SUFFIX
+
+class AtlasIndex(object):
+
+    def __init__(self, filename):
+        """Reads the atlas index filename.
+
+        __init__(AtlasIndex, str) --> void
+        """
+        with open(filename) as fd:
+            index = json.load(fd)
+        directory = os.path.dirname(filename)
+        self._sheets = [os.path.join(directory, sheet) for sheet in index['sheets']]
+        self._regions = index['regions']
+        self._cards = index['cards']
+
+    def get_sheets(self):
+        """Returns the paths of the sheets, in sheet number order.
+
+        get_sheets(AtlasIndex) --> list(str)
+        """
+        return self._sheets
+
+    def region(self, image):
+        """Returns (sheet number, x, y, width, height) of the image path
+
+        image, or None if the atlas does not hold it.
+
+        region(AtlasIndex, str) --> tuple(int)
+        """
+        region = self._regions.get(image)
+        return tuple(region) if region is not None else None
+
+    def card_region(self, meaning):
+        """Returns the region of the image of the card with meaning, or None.
+
+        card_region(AtlasIndex, str) --> tuple(int)
+        """
+        image = self._cards.get(meaning)
+        return self.region(image) if image is not None else None
+
+def build_atlas(deckname, cells=SHEET_CELLS, fmt='png', base=None):
+    """Builds the atlas of the deck deckname and returns its index path.
+
+    Image paths in the deck are resolved against base, by default the
+    current directory, as the app does.
+
+    build_atlas(str, int, str, str) --> str
+    """
+    from PIL import Image
+    from cards import Cardlist
+
+    cardlist = Cardlist()
+    cardlist.load_file(deckname)
+    cards = {}
+    images = []
+    seen = set()
+    for index in range(cardlist.length()):
+        card = cardlist.get_index(index)
+        if card.get_image() not in seen:
+            seen.add(card.get_image())
+            images.append(card.get_image())
+        cards[card.get_meaning()] = card.get_image()
+
+    target = atlas_path(deckname)
+    stem = os.path.splitext(os.path.basename(target))[0]
+    per_sheet = cells * cells
+    sheets = []
+    regions = {}
+    for start in range(0, len(images), per_sheet):
+        batch = images[start:start + per_sheet]
+        rows = (len(batch) + cells - 1) // cells
+        sheet = Image.new('RGB', (cells * CELL_WIDTH, rows * CELL_HEIGHT), 'white')
+        number = len(sheets)
+        for slot, image in enumerate(batch):
+            x = (slot % cells) * CELL_WIDTH
+            y = (slot // cells) * CELL_HEIGHT
+            try:
+                picture = Image.open(os.path.join(base or '', image)).convert('RGBA')
+            except (IOError, OSError):
+                continue
+            picture = picture.resize((CELL_WIDTH, CELL_HEIGHT))
+            sheet.paste(picture, (x, y), picture)
+            regions[image] = [number, x, y, CELL_WIDTH, CELL_HEIGHT]
+        name = "{0}-{1}.{2}".format(stem, number, fmt)
+        if fmt == 'gif':
+            sheet = sheet.convert('P', palette=Image.ADAPTIVE)
+        sheet.save(os.path.join(os.path.dirname(target), name))
+        sheets.append(name)
+
+    with open(target, 'w') as fd:
+        json.dump({'cell': [CELL_WIDTH, CELL_HEIGHT], 'sheets': sheets,
+                   'regions': regions, 'cards': cards}, fd)
+    return target
+
+def main(argv=None):
+    """Builds the texture atlas of a deck.
+
+    main(list(str)) --> int
+    """
+    parser = argparse.ArgumentParser(description="Build a Meikaichan texture atlas.")
+    parser.add_argument('deck', help="deck whose images to pack")
+    parser.add_argument('--cells', type=int, default=SHEET_CELLS, help="images per sheet side")
+    parser.add_argument('--format', choices=('png', 'gif'), default='png', help="sheet format")
+    args = parser.parse_args(argv)
+    target = build_atlas(args.deck, args.cells, args.format)
+    print("Wrote {0}".format(target))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
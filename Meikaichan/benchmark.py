@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for Meikaichan.
+
+Generates synthetic decks in the .json schema, meaning: [kanji, hiragana,
+image, audio], and measures without a display:
+
+    load      Cardlist.load_file time and the memory it allocates, from
+              JSON and from a compiled deck
+    draw      the cost of each next_question, as refresh asks it
+    grade     submit throughput in each mode
+    assets    cold and cached load latency of the bundled images and audio
+
+Results are written as JSON, with the revision and interpreter they were
+measured on, so two runs can be compared:
+
+    python benchmark.py --sizes 30,1000,100000 --output before.json
+    python benchmark.py --compare before.json after.json
+
+Runs are seeded, so the same sizes and seed generate the same decks.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from cards import Cardlist
+from deckfile import write_deck, DECK_SUFFIX
+from assets import ImageCache, AudioBank
+from quiz import QuizSession, MODES, MEIKAI, SEIKAI
+from srs import ReviewScheduler
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+clock = getattr(time, 'perf_counter', time.time)
+
+SIZES = (30, 1000, 10000, 100000, 1000000)
+SEED = 1
+
+#Questions drawn and answers graded per deck size, at most.
+DRAWS = 20000
+ANSWERS = 5000
+
+#Directories of the bundled assets, relative to this file.
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMAGE_DIR = os.path.join(HERE, 'img')
+AUDIO_DIR = os.path.join(HERE, 'sound')
+
+def synthetic_deck(filename, size, seed=SEED):
+    """Writes a deck of size cards with distinct meanings to filename.
+
+    Kanji are drawn from the CJK block and readings from hiragana; images
+    and audio cycle through the bundled files.
+
+    synthetic_deck(str, int, int) --> void
+    """
+    rng = random.Random(seed)
+    images = sorted('img/' + name for name in os.listdir(IMAGE_DIR))
+    sounds = sorted('sound/' + name for name in os.listdir(AUDIO_DIR))
+    with io.open(filename, 'w', encoding='utf-8') as fd:
+        fd.write(u'{\n')
+        for index in range(size):
+            kanji = u''.join(unichr(0x4E00 + rng.randrange(0x5000)) for _ in range(rng.randint(1, 3)))
+            hiragana = u''.join(unichr(0x3042 + rng.randrange(0x50)) for _ in range(rng.randint(2, 6)))
+            meaning = u"card {0} {1}".format(index, u'word' * rng.randint(1, 4))
+            row = json.dumps([kanji, hiragana, images[index % len(images)], sounds[index % len(sounds)]],
+                             ensure_ascii=False)
+            if isinstance(row, bytes):
+                row = row.decode('utf-8')
+            fd.write(u'  "{0}": {1}{2}\n'.format(meaning, row, u',' if index < size - 1 else u''))
+        fd.write(u'}\n')
+
+def summary(samples):
+    """Returns the count, mean, p50, p99 and max of samples, in microseconds.
+
+    summary(list(float)) --> dict
+    """
+    samples = sorted(samples)
+    count = len(samples)
+    if not count:
+        return {'count': 0}
+    rank = lambda p: samples[max(0, -(-p * count // 100) - 1)]
+    return {'count': count,
+            'mean_us': sum(samples) / count * 1e6,
+            'p50_us': rank(50) * 1e6,
+            'p99_us': rank(99) * 1e6,
+            'max_us': samples[-1] * 1e6}
+
+def timed_load(filename):
+    """Loads filename into a new Cardlist and returns it with the seconds
+
+    taken and, where tracemalloc exists, the bytes allocated and the peak,
+    measured in a second load so tracing does not slow the first.
+
+    timed_load(str) --> (Cardlist, dict)
+    """
+    start = clock()
+    cardlist = Cardlist()
+    cardlist.load_file(filename)
+    result = {'seconds': clock() - start, 'cards': cardlist.length()}
+    if tracemalloc is not None:
+        tracemalloc.start()
+        again = Cardlist()
+        again.load_file(filename)
+        result['bytes'], result['peak_bytes'] = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del again
+    return cardlist, result
+
+def bench_load(directory, size, seed=SEED):
+    """Generates a deck of size cards and times loading it as JSON and as a
+
+    compiled deck. Returns the Cardlist and the results.
+
+    bench_load(str, int, int) --> (Cardlist, dict)
+    """
+    source = os.path.join(directory, 'deck{0}.json'.format(size))
+    start = clock()
+    synthetic_deck(source, size, seed)
+    generated = clock() - start
+    cardlist, results = timed_load(source)
+    compiled = os.path.join(directory, 'deck{0}{1}'.format(size, DECK_SUFFIX))
+    write_deck(compiled, (cardlist.get_index(i) for i in range(cardlist.length())))
+    mapped, results_compiled = timed_load(compiled)
+    del mapped
+    return cardlist, {'json': results, 'compiled': results_compiled,
+                      'file_bytes': os.path.getsize(source), 'generate_seconds': generated}
+
+def bench_draw(cardlist, seed=SEED, draws=DRAWS):
+    """Times the first question, which indexes the deck, and then each of
+
+    draws further questions.
+
+    bench_draw(Cardlist, int, int) --> dict
+    """
+    session = QuizSession(cardlist, MEIKAI, rng=random.Random(seed), scheduler=ReviewScheduler())
+    start = clock()
+    session.next_question()
+    first = clock() - start
+    samples = []
+    for _ in range(draws):
+        start = clock()
+        session.next_question()
+        samples.append(clock() - start)
+    result = summary(samples)
+    result['first_seconds'] = first
+    return result
+
+def answer_for(mode, question, rng):
+    """Returns an answer to question in mode: right, wrong, or for typed
+
+    modes one typo off, about a third of the time each.
+
+    answer_for(str, Question, Random) --> str
+    """
+    if mode == MEIKAI:
+        return rng.choice(question.choices)
+    right = question.card.get_meaning() if mode == SEIKAI else question.card.get_hiragana()
+    pick = rng.randint(0, 2)
+    if pick == 0:
+        return right
+    elif pick == 1:
+        return right[:-1] + u'x'
+    return u'wrong answer'
+
+def bench_grade(cardlist, seed=SEED, answers=ANSWERS):
+    """Times submit for answers answers in each mode and returns the
+
+    throughput and latency of each.
+
+    bench_grade(Cardlist, int, int) --> dict
+    """
+    results = {}
+    for mode in MODES:
+        rng = random.Random(seed)
+        session = QuizSession(cardlist, mode, rng=rng, scheduler=ReviewScheduler())
+        samples = []
+        for _ in range(answers):
+            question = session.next_question()
+            text = answer_for(mode, question, rng)
+            start = clock()
+            session.submit(text)
+            samples.append(clock() - start)
+        result = summary(samples)
+        result['per_second'] = len(samples) / sum(samples) if sum(samples) else None
+        result['correct'] = session.get_correct()
+        results[mode] = result
+    return results
+
+def bench_assets():
+    """Times loading every bundled image and audio file through the app's
+
+    caches, cold and then cached. Files are read, not decoded, since
+    decoding needs Tk and a mixer.
+
+    bench_assets() --> dict
+    """
+    def read(path):
+        with open(path, 'rb') as fd:
+            return fd.read()
+
+    results = {}
+    for name, cache, directory in (('image', ImageCache(read, len), IMAGE_DIR),
+                                   ('audio', AudioBank(read, len), AUDIO_DIR)):
+        paths = sorted(os.path.join(directory, f) for f in os.listdir(directory))
+        for phase in ('cold', 'cached'):
+            samples = []
+            for path in paths:
+                start = clock()
+                cache.load(path)
+                samples.append(clock() - start)
+            results['{0}_{1}'.format(name, phase)] = summary(samples)
+    return results
+
+def revision():
+    """Returns the git revision of this tree, or None.
+
+    revision() --> str
+    """
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE,
+                                         stderr=open(os.devnull, 'w'))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+def run(sizes=SIZES, seed=SEED, draws=DRAWS, answers=ANSWERS, log=sys.stderr):
+    """Runs every benchmark on decks of each of sizes and returns the results.
+
+    run(tuple(int), int, int, int, file) --> dict
+    """
+    results = {'revision': revision(),
+               'python': platform.python_version(),
+               'implementation': platform.python_implementation(),
+               'platform': platform.platform(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'seed': seed,
+               'assets': bench_assets(),
+               'decks': {}}
+    directory = tempfile.mkdtemp(prefix='meikaichan-bench')
+    try:
+        for size in sizes:
+            log.write("{0} cards...\n".format(size))
+            cardlist, load = bench_load(directory, size, seed)
+            results['decks'][str(size)] = {'load': load,
+                                           'draw': bench_draw(cardlist, seed, draws),
+                                           'grade': bench_grade(cardlist, seed, answers)}
+            del cardlist
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+def flatten(results, prefix=''):
+    """Returns the numbers in results keyed by their dotted path.
+
+    flatten(dict, str) --> dict
+    """
+    flat = {}
+    for key, value in results.items():
+        path = prefix + key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+def compare(before, after, out=sys.stdout):
+    """Writes the change of every measurement present in both result sets.
+
+    compare(dict, dict, file) --> void
+    """
+    old, new = flatten(before), flatten(after)
+    out.write("{0} -> {1}\n".format(before.get('revision'), after.get('revision')))
+    for path in sorted(set(old) & set(new)):
+        if path == 'seed':
+            continue
+        change = (new[path] - old[path]) / float(old[path]) if old[path] else 0.0
+        out.write("{0:<48}{1:>14.3f}{2:>14.3f}{3:>+9.1%}\n".format(path, old[path], new[path], change))
+
+def main(argv=None):
+    """Runs the benchmarks, or compares two result files.
+
+    main(list(str)) --> int
+    """
+    parser = argparse.ArgumentParser(description="Benchmark Meikaichan without a display.")
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES),
+                        help="comma separated deck sizes")
+    parser.add_argument('--seed', type=int, default=SEED, help="seed for decks and answers")
+    parser.add_argument('--draws', type=int, default=DRAWS, help="questions drawn per deck")
+    parser.add_argument('--answers', type=int, default=ANSWERS, help="answers graded per mode")
+    parser.add_argument('--output', help="file to write the JSON results to, default stdout")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help="compare two result files instead of running")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as fd:
+            before = json.load(fd)
+        with open(args.compare[1]) as fd:
+            after = json.load(fd)
+        compare(before, after)
+        return 0
+
+    sizes = tuple(int(size) for size in args.sizes.split(','))
+    results = run(sizes, args.seed, args.draws, args.answers)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            fd.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,809 @@
+# -*- coding: utf-8 -*-
+
+"""
+Card model for Meikaichan.
+
+Kanjicard holds a single flash card and Cardlist a deck of cards read from
+a JSON dictionary file. Neither depends on Tkinter or pygame so they can be
+used by the quiz engine without a display.
+
+A Cardlist keeps its cards in a CardStore rather than as Kanjicard objects:
+the text of every card is packed into one UTF-8 buffer, and image and audio
+paths, which repeat across a deck, are stored once and referenced by number.
+Kanjicard objects are only built when a card is asked for.
+
+Decks are read as a stream, one card at a time, either from the JSON
+dictionary format
+
+    {"Fire": ["火", "ひ", "img/fire.gif", "sound/fire.mp3"], ...}
+
+or from JSON Lines decks (.jsonl), one card per line in either of the forms
+
+    {"Fire": ["火", "ひ", "img/fire.gif", "sound/fire.mp3"]}
+    ["Fire", "火", "ひ", "img/fire.gif", "sound/fire.mp3"]
+
+A deck being edited is watched with DeckWatcher and re-read with
+Cardlist.reload_file, which applies only the differences to the loaded
+cards so a session over them can carry on.
+"""
+
+import io
+import os
+import json
+import codecs
+from array import array
+
+from lookup import CardLookup
+from instrument import timed
+
+codecs.register(lambda name: codecs.lookup('utf-8') if name == 'cp65001' else None)
+
+DISPLAY_FORMAT = "{0}{1}{2}{4}"
+
+#Suffixes of JSON Lines decks.
+JSONL_SUFFIXES = ('.jsonl', '.ndjson')
+
+#Characters read from a deck file at a time.
+READ_CHUNK = 64 * 1024
+
+STRING_TYPES = (type(u''), str)
+
+class Kanjicard(object):
+
+    __slots__ = ('_kanji', '_hiragana', '_meaning', '_image', '_audio')
+
+    def __init__(self, meaning, kanji, hiragana, image, audio):
+        """Initializes the Kanji Card, supplying it with a kanji, meaning, and
+
+        image file name.
+        """
+        self._kanji = kanji
+        self._hiragana = hiragana
+        self._meaning = meaning
+        self._image = image
+        self._audio = audio
+
+    def get_kanji(self):
+        """Returns the Kanji of a card.
+
+        get_kanji(self._kanji) --> str
+        """
+        return self._kanji
+
+    def get_hiragana(self):
+        return self._hiragana
+
+    def get_meaning(self):
+        """Returns the meaning of a card.
+
+        get_meaning(self._meaning) --> str
+        """
+        return self._meaning
+
+    def get_image(self):
+        """Returns the image file of a card.
+
+        get_image(self._image) --> str
+        """
+        return self._image
+
+    def get_audio(self):
+        """Returns the audio file of a card.
+
+        get_audio(self._audio) --> str
+        """
+        return self._audio
+
+    def __str__(self):
+        """Returns a str of Kanjicard in DISPLAY_FORMAT.
+
+        __str__(Kanjicard) --> str"""
+        return DISPLAY_FORMAT.format(self.get_kanji, self.get_meaning, self.get_image)
+
+    def __repr__(self):
+        """Returns a repr of Kanjicard.
+
+        __repr__(Kanjicard) --> str"""
+        return "Kanjicard({0}, {1}, {2}, {3})".format(self.get_kanji, self.get_meaning, self.get_image)
+
+class CardStore(object):
+
+    def __init__(self):
+        """Initializes an empty store.
+
+        __init__(CardStore) --> void
+        """
+        #Card i has its meaning, kanji and hiragana at strings b, b+1 and
+        #b+2 of the text buffer, b = _bases[i]; string n ends at byte
+        #_ends[n + 1]. Strings of updated and removed cards are left behind
+        #as waste until the buffer is compacted.
+        self._text = bytearray()
+        self._ends = array('L', [0])
+        self._bases = array('L')
+        self._waste = 0
+        #Interned image and audio paths, and each card's index into them.
+        self._paths = []
+        self._path_ids = {}
+        self._images = array('L')
+        self._audio = array('L')
+
+    def _intern(self, path):
+        """Returns the number of path in the path table, adding it if new.
+
+        _intern(CardStore, str) --> int
+        """
+        num = self._path_ids.get(path)
+        if num is None:
+            num = len(self._paths)
+            self._paths.append(path)
+            self._path_ids[path] = num
+        return num
+
+    def _string(self, num):
+        """Returns string num of the text buffer.
+
+        _string(CardStore, int) --> str
+        """
+        return self._text[self._ends[num]:self._ends[num + 1]].decode('utf-8')
+
+    def _append_strings(self, meaning, kanji, hiragana):
+        """Appends the three strings of a card and returns the number of the
+
+        first.
+
+        _append_strings(CardStore, str, str, str) --> int
+        """
+        base = len(self._ends) - 1
+        for text in (meaning, kanji, hiragana):
+            self._text.extend(text.encode('utf-8'))
+            self._ends.append(len(self._text))
+        return base
+
+    def add(self, meaning, kanji, hiragana, image, audio):
+        """Appends a card to the store and returns its index.
+
+        add(CardStore, str, str, str, str, str) --> int
+        """
+        self._bases.append(self._append_strings(meaning, kanji, hiragana))
+        self._images.append(self._intern(image))
+        self._audio.append(self._intern(audio))
+        return len(self._images) - 1
+
+    def update(self, index, meaning, kanji, hiragana, image, audio):
+        """Replaces the card at index.
+
+        update(CardStore, int, str, str, str, str, str) --> void
+        """
+        self._waste += 3
+        self._bases[index] = self._append_strings(meaning, kanji, hiragana)
+        self._images[index] = self._intern(image)
+        self._audio[index] = self._intern(audio)
+        self._compact()
+
+    def remove(self, index):
+        """Removes the card at index by moving the last card into its place.
+
+        Returns the old index of the card moved, or None if the last card
+        was removed.
+
+        remove(CardStore, int) --> int
+        """
+        last = len(self._bases) - 1
+        moved = None
+        if index != last:
+            self._bases[index] = self._bases[last]
+            self._images[index] = self._images[last]
+            self._audio[index] = self._audio[last]
+            moved = last
+        self._bases.pop()
+        self._images.pop()
+        self._audio.pop()
+        self._waste += 3
+        self._compact()
+        return moved
+
+    def _compact(self):
+        """Rewrites the text buffer without waste once over half of its
+
+        strings are waste.
+
+        _compact(CardStore) --> void
+        """
+        if self._waste * 2 <= len(self._ends):
+            return
+        text = bytearray()
+        ends = array('L', [0])
+        for index in range(len(self._bases)):
+            base = self._bases[index]
+            self._bases[index] = len(ends) - 1
+            text.extend(self._text[self._ends[base]:self._ends[base + 3]])
+            for num in range(base, base + 3):
+                ends.append(ends[-1] + self._ends[num + 1] - self._ends[num])
+        self._text = text
+        self._ends = ends
+        self._waste = 0
+
+    def get(self, index):
+        """Returns a Kanjicard view of the card at index.
+
+        get(CardStore, int) --> Kanjicard
+        """
+        if index < 0:
+            index += len(self._images)
+        base = self._bases[index]
+        return Kanjicard(self._string(base), self._string(base + 1), self._string(base + 2),
+                         self._paths[self._images[index]], self._paths[self._audio[index]])
+
+    def get_meaning(self, index):
+        """Returns the meaning of the card at index without building a view.
+
+        get_meaning(CardStore, int) --> str
+        """
+        return self._string(self._bases[index])
+
+    def copy(self):
+        """Returns a copy of the store, unaffected by later changes to it.
+
+        copy(CardStore) --> CardStore
+        """
+        store = CardStore()
+        store._text = bytearray(self._text)
+        store._ends = array('L', self._ends)
+        store._bases = array('L', self._bases)
+        store._waste = self._waste
+        store._paths = list(self._paths)
+        store._path_ids = dict(self._path_ids)
+        store._images = array('L', self._images)
+        store._audio = array('L', self._audio)
+        return store
+
+    def close(self):
+        """Does nothing; a CardStore holds no file open.
+
+        close(CardStore) --> void
+        """
+        pass
+
+    def __len__(self):
+        """Returns the number of cards in the store.
+
+        __len__(CardStore) --> int
+        """
+        return len(self._images)
+
+class LoadReport(object):
+
+    def __init__(self):
+        """Initializes an empty report of a deck load.
+
+        duplicates and malformed hold (location, description) pairs, where
+        location names the file and the entry or line of the problem.
+
+        __init__(LoadReport) --> void
+        """
+        self.loaded = 0
+        self.duplicates = []
+        self.malformed = []
+
+    def is_clean(self):
+        """Returns True if no duplicate or malformed cards were found.
+
+        is_clean(LoadReport) --> bool
+        """
+        return not self.duplicates and not self.malformed
+
+    def get_lines(self):
+        """Returns a summary of the load, one problem per line.
+
+        get_lines(LoadReport) --> list(str)
+        """
+        lines = [u"Loaded {0} cards, {1} duplicates, {2} malformed".format(
+            self.loaded, len(self.duplicates), len(self.malformed))]
+        for location, problem in self.duplicates + self.malformed:
+            lines.append(u"{0}: {1}".format(location, problem))
+        return lines
+
+    def __str__(self):
+        """Returns the lines of get_lines as one string, UTF-8 encoded on
+
+        Python 2.
+
+        __str__(LoadReport) --> str
+        """
+        text = u"\n".join(self.get_lines())
+        return text if str is not bytes else text.encode('utf-8')
+
+def _card_row(meaning, value):
+    """Returns the card (meaning, kanji, hiragana, image, audio) for a deck
+
+    entry, or None if the entry is malformed.
+
+    _card_row(str, list) --> tuple(str)
+    """
+    if not isinstance(meaning, STRING_TYPES) or not isinstance(value, list) or len(value) != 4:
+        return None
+    if not all(isinstance(field, STRING_TYPES) for field in value):
+        return None
+    return (meaning,) + tuple(value)
+
+def _iter_jsonl(fd, filename, report):
+    """Yields the cards of a JSON Lines deck, one per line.
+
+    _iter_jsonl(file, str, LoadReport) --> iter(tuple(str))
+    """
+    decoder = json.JSONDecoder(strict=False)
+    for number, line in enumerate(fd, 1):
+        line = line.strip()
+        if not line:
+            continue
+        location = u"{0}:{1}".format(filename, number)
+        try:
+            entry = decoder.decode(line)
+        except ValueError as e:
+            report.malformed.append((location, str(e)))
+            continue
+        if isinstance(entry, dict) and len(entry) == 1:
+            row = _card_row(*list(entry.items())[0])
+        elif isinstance(entry, list) and len(entry) == 5:
+            row = _card_row(entry[0], entry[1:])
+        else:
+            row = None
+        if row is None:
+            report.malformed.append((location, "expected one card"))
+        else:
+            yield location, row
+
+def _iter_object(fd, filename, report):
+    """Yields the cards of a JSON dictionary deck as its entries are read,
+
+    without holding the whole file in memory. A syntax error ends the file.
+
+    _iter_object(file, str, LoadReport) --> iter(tuple(str))
+    """
+    decoder = json.JSONDecoder(strict=False)
+    state = {'buf': u'', 'pos': 0, 'eof': False}
+
+    def space():
+        #Skips whitespace, returning False at the end of the file.
+        while True:
+            buf, pos = state['buf'], state['pos']
+            while pos < len(buf) and buf[pos] in u' \t\r\n':
+                pos += 1
+            state['pos'] = pos
+            if pos < len(buf):
+                return True
+            if not more():
+                return False
+
+    def skip(expected):
+        #Skips whitespace and returns the next character, one of expected.
+        if not space():
+            raise ValueError("unexpected end of file")
+        char = state['buf'][state['pos']]
+        if char not in expected:
+            raise ValueError("expected one of {0!r} at entry {1}".format(str(expected), number))
+        state['pos'] += 1
+        return char
+
+    def value():
+        #Decodes the next JSON value, reading more of the file as needed.
+        space()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(state['buf'], state['pos'])
+            except ValueError:
+                if not more():
+                    raise
+                continue
+            if end == len(state['buf']) and more():
+                continue
+            state['pos'] = end
+            return obj
+
+    def more():
+        #Reads another chunk, dropping what has been consumed.
+        if state['eof']:
+            return False
+        chunk = fd.read(READ_CHUNK)
+        if not chunk:
+            state['eof'] = True
+            return False
+        state['buf'] = state['buf'][state['pos']:] + chunk
+        state['pos'] = 0
+        return True
+
+    number = 0
+    try:
+        skip(u'{')
+        closing = u'}"'
+        while skip(closing) != u'}':
+            number += 1
+            state['pos'] -= 1
+            meaning = value()
+            skip(u':')
+            entry = value()
+            location = u"{0}:entry {1}".format(filename, number)
+            row = _card_row(meaning, entry)
+            if row is None:
+                report.malformed.append((location, "expected [kanji, hiragana, image, audio]"))
+            else:
+                yield location, row
+            if skip(u',}') == u'}':
+                break
+            closing = u'"'
+    except ValueError as e:
+        report.malformed.append((u"{0}:entry {1}".format(filename, number), str(e)))
+
+def iter_deck(filename, report=None):
+    """Yields (location, card) for each card of the JSON or JSON Lines deck
+
+    filename as it is read, where card is (meaning, kanji, hiragana, image,
+    audio). Malformed entries are recorded in report and skipped.
+
+    iter_deck(str, LoadReport) --> iter((str, tuple(str)))
+    """
+    if report is None:
+        report = LoadReport()
+    with io.open(filename, 'r', encoding='utf-8-sig') as fd:
+        if filename.lower().endswith(JSONL_SUFFIXES):
+            rows = _iter_jsonl(fd, filename, report)
+        else:
+            rows = _iter_object(fd, filename, report)
+        for row in rows:
+            yield row
+
+def replay_changes(index, changes, size):
+    """Applies the changes made by Cardlist.reload_file to index, a card
+
+    index with add(index, card), remove(index, card) and resize(size) such
+    as a DistractorIndex, which covered every card before the changes or,
+    like an AnswerIndex, keeps each card's entry at its own index.
+
+    replay_changes(index, list(tuple), int) --> void
+    """
+    for change in changes:
+        kind = change[0]
+        if kind == 'update':
+            index.remove(change[1], change[2])
+            index.add(change[1], change[3])
+        elif kind == 'remove':
+            index.remove(change[1], change[2])
+        elif kind == 'move':
+            index.remove(change[1], change[3])
+            index.add(change[2], change[3])
+        elif kind == 'add':
+            index.add(change[1], change[2])
+    index.resize(size)
+
+class DeckWatcher(object):
+
+    def __init__(self, filename):
+        """Initializes a watcher of the deck file filename as it is now.
+
+        __init__(DeckWatcher, str) --> void
+        """
+        self._filename = filename
+        self._stamp = self._stat()
+
+    def _stat(self):
+        """Returns the modification time and size of the file, or None.
+
+        _stat(DeckWatcher) --> tuple
+        """
+        try:
+            stat = os.stat(self._filename)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def changed(self):
+        """Returns True if the file was modified since the last call. Only
+
+        its modification time and size are read, so polling is cheap.
+
+        changed(DeckWatcher) --> bool
+        """
+        stamp = self._stat()
+        if stamp is None or stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        return True
+
+class Cardlist(object):
+
+    def __init__(self, cache=None):
+        """Initializes the Cards List to be empty.
+
+        If cache, a DeckCache, is given JSON decks are served from it when
+        unchanged and stored in it after being parsed.
+
+        __init__(Cardlist, DeckCache) --> void
+        """
+
+        self._cards = CardStore()
+        self._cache = cache
+        self._positions = None
+        self._lookup = None
+        
+    def load_file(self, filename):
+        """Read a Cardlist from a .json, .jsonl or compiled deck file.
+
+        A compiled deck loaded into an empty Cardlist is memory-mapped and
+        decoded lazily; otherwise its cards are copied in.
+
+        load_file(Cardlist, str) --> LoadReport
+        """
+        return self.load_files([filename])
+
+    @timed('load_file')
+    def load_files(self, filenames):
+        """Merges the cards of several deck files into the Cardlist in one
+
+        pass. A card whose meaning was already read from these files is
+        reported as a duplicate and skipped, as are malformed entries.
+
+        load_files(Cardlist, list(str)) --> LoadReport
+        """
+        import deckfile
+        report = LoadReport()
+        seen = set()
+        for filename in filenames:
+            compiled = filename if deckfile.is_deck(filename) else None
+            if compiled is None and self._cache is not None:
+                compiled = self._cache.lookup(filename)
+            parsed = None
+            if compiled is not None:
+                mapped = deckfile.MappedCardStore(compiled)
+                if not self.length() and len(filenames) == 1:
+                    self._cards = mapped
+                    self._positions = None
+                    self._lookup = None
+                    report.loaded = len(mapped)
+                    continue
+                rows = ((u"{0}:card {1}".format(filename, index + 1),
+                         deckfile.card_fields(mapped.get(index)))
+                        for index in range(len(mapped)))
+            else:
+                mapped = None
+                rows = iter_deck(filename, report)
+                if self._cache is not None:
+                    parsed = []
+                    problems = len(report.duplicates) + len(report.malformed)
+            for location, row in rows:
+                if parsed is not None:
+                    parsed.append(row)
+                if row[0] in seen:
+                    report.duplicates.append((location, "duplicate meaning {0!r}".format(row[0])))
+                    continue
+                seen.add(row[0])
+                index = self._writable().add(*row)
+                if self._positions is not None:
+                    self._positions.setdefault(row[0], index)
+                report.loaded += 1
+            if mapped is not None:
+                mapped.close()
+            #Only decks parsed without problems are cached, so a later load
+            #of a broken deck reports its problems again.
+            if parsed is not None and problems == len(report.duplicates) + len(report.malformed):
+                try:
+                    self._cache.store(filename, parsed)
+                except (IOError, OSError):
+                    pass
+        return report
+
+    def _writable(self):
+        """Returns the card store, first copying a memory-mapped deck into
+
+        a CardStore so cards can be added to it.
+
+        _writable(Cardlist) --> CardStore
+        """
+        if not isinstance(self._cards, CardStore):
+            mapped = self._cards
+            self._cards = CardStore()
+            for index in range(len(mapped)):
+                self._add_card(mapped.get(index))
+            mapped.close()
+        return self._cards
+
+    def _add_card(self, card):
+        """Appends a copy of card to the card store.
+
+        _add_card(Cardlist, Kanjicard) --> void
+        """
+        self._writable().add(card.get_meaning(), card.get_kanji(), card.get_hiragana(),
+                             card.get_image(), card.get_audio())
+
+    def snapshot(self):
+        """Returns a card store holding the cards as they are now, which
+
+        another thread may read while the Cardlist changes. Close it when
+        done.
+
+        snapshot(Cardlist) --> CardStore
+        """
+        return self._cards.copy()
+
+    def replace_file(self, filename):
+        """Replaces the cards with those of the deck file filename, unless
+
+        it has no valid cards, in which case the Cardlist is left as it was.
+
+        replace_file(Cardlist, str) --> LoadReport
+        """
+        fresh = Cardlist(self._cache)
+        report = fresh.load_file(filename)
+        if report.loaded:
+            self.clear()
+            self._cards = fresh._cards
+            self._positions = fresh._positions
+            self._lookup = fresh._lookup
+        return report
+
+    def clear(self):
+        """Removes every card, e.g. before another deck replaces them.
+
+        clear(Cardlist) --> void
+        """
+        if not isinstance(self._cards, CardStore):
+            self._cards.close()
+        self._cards = CardStore()
+        self._positions = None
+        self._lookup = None
+
+    def reload_file(self, filename):
+        """Re-reads filename, the deck loaded into the Cardlist, and applies
+
+        the differences in place, matching cards by meaning: changed cards
+        are updated, cards no longer in the file removed and new ones added
+        at the end. Nothing is changed if the file has malformed entries or
+        no cards, as it may be half written.
+
+        Returns the report of the read and the changes made, in order:
+        ('update', index, old card, new card), ('remove', index, old card),
+        ('move', old index, new index, card) when a removal moves the last
+        card into the gap, and ('add', index, card). Indexes built over the
+        Cardlist are brought up to date with replay_changes.
+
+        reload_file(Cardlist, str) --> (LoadReport, list(tuple))
+        """
+        import deckfile
+        report = LoadReport()
+        if deckfile.is_deck(filename):
+            mapped = deckfile.MappedCardStore(filename)
+            rows = ((u"{0}:card {1}".format(filename, index + 1), deckfile.card_fields(mapped.get(index)))
+                    for index in range(len(mapped)))
+        else:
+            mapped = None
+            rows = iter_deck(filename, report)
+        fresh = {}
+        order = []
+        try:
+            for location, row in rows:
+                if row[0] in fresh:
+                    report.duplicates.append((location, "duplicate meaning {0!r}".format(row[0])))
+                    continue
+                fresh[row[0]] = row
+                order.append(row[0])
+        finally:
+            if mapped is not None:
+                mapped.close()
+        report.loaded = len(fresh)
+        if report.malformed or not fresh:
+            return report, []
+
+        updates = []
+        removed = []
+        kept = set()
+        for index in range(self.length()):
+            card = self.get_index(index)
+            meaning = card.get_meaning()
+            row = fresh.get(meaning)
+            if row is None or meaning in kept:
+                removed.append(index)
+                continue
+            kept.add(meaning)
+            if deckfile.card_fields(card) != row:
+                updates.append((index, card, row))
+        added = [fresh[meaning] for meaning in order if meaning not in kept]
+        if not updates and not removed and not added:
+            return report, []
+
+        store = self._writable()
+        changes = []
+        for index, card, row in updates:
+            store.update(index, *row)
+            changes.append(('update', index, card, Kanjicard(*row)))
+        #Removing from the end first, the card moved into a gap is always
+        #one being kept.
+        for index in reversed(removed):
+            card = self.get_index(index)
+            moved = store.remove(index)
+            changes.append(('remove', index, card))
+            if moved is not None:
+                changes.append(('move', moved, index, self.get_index(index)))
+        for row in added:
+            changes.append(('add', store.add(*row), Kanjicard(*row)))
+
+        size = self.length()
+        if self._positions is not None:
+            for change in changes:
+                if change[0] == 'remove' and self._positions.get(change[2].get_meaning()) == change[1]:
+                    del self._positions[change[2].get_meaning()]
+                elif change[0] == 'move':
+                    self._positions[change[3].get_meaning()] = change[2]
+                elif change[0] == 'add':
+                    self._positions[change[2].get_meaning()] = change[1]
+        if self._lookup is not None:
+            if len(self._lookup) == size - len(added) + len(removed):
+                replay_changes(self._lookup, changes, size)
+            else:
+                self._lookup = None
+        return report, changes
+
+    def index_of(self, meaning):
+        """Returns the index of the card with meaning, or None.
+
+        The first call builds a table of every meaning; later ones are O(1).
+
+        index_of(Cardlist, str) --> int
+        """
+        if self._positions is None:
+            self._positions = {}
+            for index in range(self.length()):
+                self._positions.setdefault(self._cards.get_meaning(index), index)
+        return self._positions.get(meaning)
+
+    def find_reading(self, prefix):
+        """Returns the indexes of the cards whose reading starts with prefix.
+
+        find_reading(Cardlist, str) --> list(int)
+        """
+        return self._card_lookup().find_reading(prefix)
+
+    def find_kanji(self, chars):
+        """Returns the indexes of the cards containing every kanji in chars.
+
+        find_kanji(Cardlist, str) --> list(int)
+        """
+        return self._card_lookup().find_kanji(chars)
+
+    def _card_lookup(self):
+        """Returns the reading and kanji lookup, indexing any cards added
+
+        since it was last used.
+
+        _card_lookup(Cardlist) --> CardLookup
+        """
+        if self._lookup is None:
+            self._lookup = CardLookup()
+        self._lookup.extend(self)
+        return self._lookup
+
+    def get_index(self, index):
+        """Returns the index of a card.
+
+        get_index(Cardlist, index) --> index
+        """
+        return self._cards.get(index)
+
+    def get_meaning(self, index):
+        """Returns the meaning of the card at index.
+
+        get_meaning(Cardlist, int) --> str
+        """
+        return self._cards.get_meaning(index)
+
+    def length(self):
+        """Returns the length of the card list.
+
+        length(Cardlist) --> length
+        """
+        return len(self._cards)
+
+    def __str__(self):
+        """Returns a str of the card list.
+
+        __str__(Cardlist) --> str
+        """
+        return "{0}".format([self.get_index(i) for i in range(self.length())])
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+
+"""
+Deck builder for Meikaichan.
+
+Builds decks from large dictionary dumps instead of writing them by hand.
+The dump is read as a stream and cut into chunks of records, which a
+process pool turns into cards: entries outside the chosen levels are
+dropped, a reading and up to MEANINGS meanings are picked, and image and
+audio paths are resolved from templates. At most two chunks per process
+are in flight, so memory stays bounded whatever the size of the dump.
+
+Sources:
+
+    .xml    KANJIDIC2 <character> or JMdict <entry> records
+    .tsv    a header row naming kanji, reading, meaning and optionally
+            grade, jlpt, image and audio columns; meanings split on ";"
+
+Decks are written merged or in shards of --shard cards, as .json, .jsonl
+or compiled .mkdeck files (see deckfile.py), chosen by the target suffix.
+Meanings repeated in the dump get their kanji appended, e.g. "day (日)".
+
+Usage:
+
+    python deckbuild.py kanjidic2.xml "Kanji N5.json" --jlpt 4 --jobs 8
+    python deckbuild.py words.tsv words.mkdeck --shard 5000
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import argparse
+import multiprocessing
+from collections import deque
+
+from cards import Kanjicard
+from answers import KATAKANA_TO_HIRAGANA
+from deckfile import write_deck, DECK_SUFFIX
+
+#Records per chunk handed to a worker, and chunks in flight per worker.
+CHUNK_RECORDS = 2000
+IN_FLIGHT = 2
+
+#Meanings kept per card, joined so each is accepted as a synonym.
+MEANINGS = 3
+MEANING_SEPARATOR = u'; '
+
+#Asset path templates, filled with the card's slug, kanji and reading,
+#and what to use when the resolved file does not exist.
+IMAGE_TEMPLATE = u'img/{slug}.gif'
+AUDIO_TEMPLATE = u'sound/{slug}.mp3'
+DEFAULT_IMAGE = u'img/default.gif'
+
+READ_CHUNK = 1 << 16
+
+#Entities of the XML dumps' DTDs are replaced by their names.
+ENTITY = re.compile(r'&(?!(?:amp|lt|gt|quot|apos|#[0-9]+|#x[0-9a-fA-F]+);)([\w.-]+);')
+RECORD_END = {'character': u'</character>', 'entry': u'</entry>'}
+
+class Options(object):
+    """What to keep from each record and where its assets are."""
+
+    def __init__(self, grades=None, jlpt=None, reading='kun', meanings=MEANINGS,
+                 image=IMAGE_TEMPLATE, audio=AUDIO_TEMPLATE, default_image=DEFAULT_IMAGE,
+                 default_audio=None, base='.'):
+        self.grades = grades
+        self.jlpt = jlpt
+        self.reading = reading
+        self.meanings = meanings
+        self.image = image
+        self.audio = audio
+        self.default_image = default_image
+        self.default_audio = default_audio
+        self.base = base
+
+def to_hiragana(reading):
+    """Returns reading in hiragana, without KANJIDIC's okurigana dot and
+
+    affix dashes.
+
+    to_hiragana(str) --> str
+    """
+    return reading.translate(KATAKANA_TO_HIRAGANA).replace(u'.', u'').replace(u'-', u'')
+
+def slug(meaning):
+    """Returns a file name stem for meaning, e.g. "big_tree".
+
+    slug(str) --> str
+    """
+    return u'_'.join(re.findall(r'\w+', meaning.split(MEANING_SEPARATOR)[0].lower(), re.UNICODE))
+
+def resolve(template, default, fields, base, exists):
+    """Returns template filled with fields, or default if that file does
+
+    not exist under base and a default is given.
+
+    resolve(str, str, dict, str, dict) --> str
+    """
+    path = template.format(**fields)
+    if default is None:
+        return path
+    found = exists.get(path)
+    if found is None:
+        found = exists[path] = os.path.exists(os.path.join(base, path))
+    return path if found else default
+
+def make_card(kanji, readings, meanings, grade, jlpt, options, exists):
+    """Returns the card (meaning, kanji, hiragana, image, audio) of a
+
+    dictionary record, or None if it is filtered out or incomplete.
+    readings are (kind, reading) pairs, kind 'kun', 'on' or ''.
+
+    make_card(str, list, list, int, int, Options, dict) --> tuple(str)
+    """
+    if options.grades and grade not in options.grades:
+        return None
+    if options.jlpt and jlpt not in options.jlpt:
+        return None
+    if not kanji or not readings or not meanings:
+        return None
+    preferred = [reading for kind, reading in readings if kind == options.reading]
+    hiragana = to_hiragana((preferred or [readings[0][1]])[0])
+    meaning = MEANING_SEPARATOR.join(meanings[:options.meanings])
+    fields = {'slug': slug(meaning), 'kanji': kanji, 'reading': hiragana}
+    image = resolve(options.image, options.default_image, fields, options.base, exists)
+    audio = resolve(options.audio, options.default_audio, fields, options.base, exists)
+    return (meaning, kanji, hiragana, image, audio)
+
+def _level(text):
+    """Returns text as an int level, or None.
+
+    _level(str) --> int
+    """
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return None
+
+def parse_xml(chunk, options, exists):
+    """Returns the cards of a chunk of KANJIDIC2 or JMdict records.
+
+    parse_xml(str, Options, dict) --> list(tuple(str))
+    """
+    import xml.etree.ElementTree as ElementTree
+    root = ElementTree.fromstring((u'<chunk>' + ENTITY.sub(r'\1', chunk) + u'</chunk>').encode('utf-8'))
+    cards = []
+    for record in root:
+        if record.tag == 'character':
+            readings = [(reading.get('r_type', '')[3:], reading.text)
+                        for reading in record.iter('reading')
+                        if reading.get('r_type') in ('ja_kun', 'ja_on') and reading.text]
+            meanings = [meaning.text for meaning in record.iter('meaning')
+                        if meaning.get('m_lang') is None and meaning.text]
+            card = make_card(record.findtext('literal'), readings, meanings,
+                             _level(record.findtext('misc/grade')),
+                             _level(record.findtext('misc/jlpt')), options, exists)
+        else:
+            readings = [('', reading.text) for reading in record.iter('reb') if reading.text]
+            meanings = [gloss.text for gloss in record.iter('gloss')
+                        if gloss.get('{http://www.w3.org/XML/1998/namespace}lang', 'eng') == 'eng'
+                        and gloss.text]
+            card = make_card(record.findtext('k_ele/keb'), readings, meanings,
+                             None, None, options, exists)
+        if card is not None:
+            cards.append(card)
+    return cards
+
+def parse_tsv(chunk, columns, options, exists):
+    """Returns the cards of a chunk of TSV lines with the given columns.
+
+    parse_tsv(list(str), list(str), Options, dict) --> list(tuple(str))
+    """
+    cards = []
+    for line in chunk:
+        row = dict(zip(columns, line.rstrip(u'\r\n').split(u'\t')))
+        meanings = [part.strip() for part in row.get('meaning', u'').split(u';') if part.strip()]
+        reading = row.get('reading') or row.get('hiragana') or u''
+        readings = [('', part.strip()) for part in reading.split(u';') if part.strip()]
+        card = make_card(row.get('kanji', u'').strip(), readings, meanings,
+                         _level(row.get('grade')), _level(row.get('jlpt')), options, exists)
+        if card is not None and (row.get('image') or row.get('audio')):
+            card = card[:3] + (row.get('image') or card[3], row.get('audio') or card[4])
+        if card is not None:
+            cards.append(card)
+    return cards
+
+#Per-process cache of asset paths already checked.
+_exists = {}
+
+def build_chunk(job):
+    """Turns one chunk into cards. Runs in a worker process.
+
+    build_chunk(tuple) --> list(tuple(str))
+    """
+    kind, chunk, columns, options = job
+    if kind == 'xml':
+        return parse_xml(chunk, options, _exists)
+    return parse_tsv(chunk, columns, options, _exists)
+
+def iter_xml_chunks(fd, records=CHUNK_RECORDS):
+    """Yields the text of up to records complete <character> or <entry>
+
+    records at a time, read from fd as a stream.
+
+    iter_xml_chunks(file, int) --> iter(str)
+    """
+    buffered = u''
+    end = None
+    while True:
+        data = fd.read(READ_CHUNK)
+        buffered += data
+        if end is None:
+            found = [(buffered.find(u'<' + tag + u'>'), tag) for tag in RECORD_END]
+            found = [(pos, tag) for pos, tag in found if pos >= 0]
+            if not found:
+                if not data:
+                    return
+                continue
+            start, tag = min(found)
+            end = RECORD_END[tag]
+            buffered = buffered[start:]
+        #Hand out every full chunk buffered, and at the end what is left.
+        while True:
+            cut, count, pos = 0, 0, 0
+            while count < records:
+                pos = buffered.find(end, pos)
+                if pos < 0:
+                    break
+                pos += len(end)
+                cut, count = pos, count + 1
+            if count < records and data:
+                break
+            if cut:
+                yield buffered[:cut]
+                buffered = buffered[cut:]
+            if count < records:
+                return
+
+def iter_tsv_chunks(fd, records=CHUNK_RECORDS):
+    """Yields lists of up to records data lines read from fd.
+
+    iter_tsv_chunks(file, int) --> iter(list(str))
+    """
+    chunk = []
+    for line in fd:
+        if line.strip() and not line.startswith(u'#'):
+            chunk.append(line)
+            if len(chunk) == records:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def iter_cards(source, options, jobs=None, records=CHUNK_RECORDS):
+    """Yields the cards built from the dictionary dump source, in order,
+
+    using jobs worker processes (by default one per core).
+
+    iter_cards(str, Options, int, int) --> iter(tuple(str))
+    """
+    jobs = jobs or multiprocessing.cpu_count()
+    with io.open(source, encoding='utf-8-sig') as fd:
+        if source.lower().endswith('.xml'):
+            kind, columns = 'xml', None
+            chunks = iter_xml_chunks(fd, records)
+        else:
+            kind = 'tsv'
+            columns = [name.strip().lower() for name in fd.readline().split(u'\t')]
+            chunks = iter_tsv_chunks(fd, records)
+
+        if jobs == 1:
+            for chunk in chunks:
+                for card in build_chunk((kind, chunk, columns, options)):
+                    yield card
+            return
+
+        pool = multiprocessing.Pool(jobs)
+        try:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(build_chunk, ((kind, chunk, columns, options),)))
+                while len(pending) >= jobs * IN_FLIGHT:
+                    for card in pending.popleft().get():
+                        yield card
+            while pending:
+                for card in pending.popleft().get():
+                    yield card
+        finally:
+            pool.terminate()
+
+class DeckWriter(object):
+
+    def __init__(self, target, shard=None):
+        """Initializes a writer of decks named after target, in its format.
+
+        With shard, a new deck target-00001.suffix, target-00002.suffix ...
+        is started every shard cards.
+
+        __init__(DeckWriter, str, int) --> void
+        """
+        self._stem, self._suffix = os.path.splitext(target)
+        self._target = target
+        self._shard = shard
+        self._fd = None
+        self._cards = []
+        self._count = 0
+        self._in_deck = 0
+        self.written = []
+
+    def _open(self):
+        """Starts the next deck.
+
+        _open(DeckWriter) --> void
+        """
+        if self._shard:
+            filename = u"{0}-{1:05d}{2}".format(self._stem, len(self.written) + 1, self._suffix)
+        else:
+            filename = self._target
+        self.written.append(filename)
+        self._in_deck = 0
+        if self._suffix != DECK_SUFFIX:
+            self._fd = io.open(filename, 'w', encoding='utf-8')
+            if self._suffix != '.jsonl':
+                self._fd.write(u'{\n')
+
+    def _finish(self):
+        """Completes the current deck.
+
+        _finish(DeckWriter) --> void
+        """
+        if self._suffix == DECK_SUFFIX:
+            write_deck(self.written[-1], (Kanjicard(*card) for card in self._cards))
+            self._cards = []
+        else:
+            if self._suffix != '.jsonl':
+                self._fd.write(u'\n}\n')
+            self._fd.close()
+            self._fd = None
+
+    def add(self, card):
+        """Writes card, a tuple (meaning, kanji, hiragana, image, audio).
+
+        add(DeckWriter, tuple(str)) --> void
+        """
+        if not self.written or (self._shard and self._in_deck == self._shard):
+            if self.written:
+                self._finish()
+            self._open()
+        if self._suffix == DECK_SUFFIX:
+            self._cards.append(card)
+        else:
+            entry = json.dumps({card[0]: list(card[1:])} if self._suffix == '.jsonl' else card[0],
+                               ensure_ascii=False)
+            if isinstance(entry, bytes):
+                entry = entry.decode('utf-8')
+            if self._suffix == '.jsonl':
+                self._fd.write(entry + u'\n')
+            else:
+                row = json.dumps(list(card[1:]), ensure_ascii=False)
+                if isinstance(row, bytes):
+                    row = row.decode('utf-8')
+                self._fd.write((u',\n' if self._in_deck else u'') + u'    ' + entry + u': ' + row)
+        self._in_deck += 1
+        self._count += 1
+
+    def close(self):
+        """Completes the last deck and returns the number of cards written.
+
+        close(DeckWriter) --> int
+        """
+        if self.written:
+            self._finish()
+        return self._count
+
+def build(source, target, options, jobs=None, shard=None, records=CHUNK_RECORDS):
+    """Builds decks named after target from the dump source and returns
+
+    the number of cards and the decks written.
+
+    build(str, str, Options, int, int, int) --> (int, list(str))
+    """
+    writer = DeckWriter(target, shard)
+    seen = set()
+    for card in iter_cards(source, options, jobs, records):
+        meaning = card[0]
+        if meaning in seen:
+            meaning = u"{0} ({1})".format(meaning, card[1])
+            if meaning in seen:
+                continue
+            card = (meaning,) + card[1:]
+        seen.add(meaning)
+        writer.add(card)
+    return writer.close(), writer.written
+
+def _levels(text):
+    """Returns the set of int levels in a comma separated list, or None.
+
+    _levels(str) --> set(int)
+    """
+    return set(int(level) for level in text.split(',')) if text else None
+
+def main(argv=None):
+    """Builds decks from a dictionary dump.
+
+    main(list(str)) --> int
+    """
+    parser = argparse.ArgumentParser(description="Build Meikaichan decks from a dictionary dump.")
+    parser.add_argument('source', help="KANJIDIC2/JMdict .xml or .tsv dump")
+    parser.add_argument('target', help="deck to write: .json, .jsonl or " + DECK_SUFFIX)
+    parser.add_argument('--grade', help="comma separated school grades to keep")
+    parser.add_argument('--jlpt', help="comma separated JLPT levels to keep")
+    parser.add_argument('--reading', choices=('kun', 'on'), default='kun', help="reading to prefer")
+    parser.add_argument('--meanings', type=int, default=MEANINGS, help="meanings kept per card")
+    parser.add_argument('--image', default=IMAGE_TEMPLATE, help="image path template")
+    parser.add_argument('--audio', default=AUDIO_TEMPLATE, help="audio path template")
+    parser.add_argument('--default-image', default=DEFAULT_IMAGE,
+                        help="image used when the template's file is missing")
+    parser.add_argument('--default-audio', help="audio used when the template's file is missing")
+    parser.add_argument('--assets', default='.', help="directory asset paths are relative to")
+    parser.add_argument('--shard', type=int, help="cards per deck, default one merged deck")
+    parser.add_argument('--jobs', type=int, help="worker processes, default one per core")
+    parser.add_argument('--chunk', type=int, default=CHUNK_RECORDS, help="records per chunk")
+    args = parser.parse_args(argv)
+
+    options = Options(_levels(args.grade), _levels(args.jlpt), args.reading, args.meanings,
+                      args.image, args.audio, args.default_image, args.default_audio, args.assets)
+    count, written = build(args.source, args.target, options, args.jobs, args.shard, args.chunk)
+    print("Wrote {0} cards to {1} deck(s): {2}".format(count, len(written), ", ".join(written)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
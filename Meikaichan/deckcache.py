@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+On-disk cache of parsed decks for Meikaichan.
+
+A parsed JSON deck is stored as a compiled deck (see deckfile.py) named by
+the SHA-1 of the JSON file's content. An index maps each deck path to the
+size, mtime and content hash it had when it was cached, so reopening an
+unchanged deck costs a stat and a read of the compiled file. A deck whose
+mtime changed but whose content did not is recognised by its hash. The
+cache is bounded in bytes and evicts the least recently used decks first.
+"""
+
+import os
+import json
+import hashlib
+
+from cards import Kanjicard
+import deckfile
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.meikaichan', 'decks')
+CACHE_BYTES = 256 * 1024 * 1024
+INDEX_FILE = 'index.json'
+
+def replace_file(source, target):
+    """Renames source to target, replacing target if it exists.
+
+    replace_file(str, str) --> void
+    """
+    try:
+        os.replace(source, target)
+    except AttributeError:
+        if os.path.exists(target):
+            os.remove(target)
+        os.rename(source, target)
+
+def file_hash(filename):
+    """Returns the SHA-1 hex digest of the content of filename.
+
+    file_hash(str) --> str
+    """
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class DeckCache(object):
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_BYTES):
+        """Initializes a cache of compiled decks in directory.
+
+        __init__(DeckCache, str, int) --> void
+        """
+        self._dir = directory
+        self._max_bytes = max_bytes
+        self._index = None
+
+    def _load_index(self):
+        """Returns the index of cached decks, reading it on first use.
+
+        _load_index(DeckCache) --> dict
+        """
+        if self._index is None:
+            try:
+                with open(os.path.join(self._dir, INDEX_FILE)) as fd:
+                    self._index = json.load(fd)
+            except (IOError, OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _save_index(self):
+        """Writes the index of cached decks.
+
+        _save_index(DeckCache) --> void
+        """
+        path = os.path.join(self._dir, INDEX_FILE)
+        with open(path + '.tmp', 'w') as fd:
+            json.dump(self._index, fd)
+        replace_file(path + '.tmp', path)
+
+    def _deck_path(self, digest):
+        """Returns the path of the compiled deck with content hash digest.
+
+        _deck_path(DeckCache, str) --> str
+        """
+        return os.path.join(self._dir, digest + deckfile.DECK_SUFFIX)
+
+    def lookup(self, filename):
+        """Returns the path of the compiled copy of the deck filename, or
+
+        None if it is not cached or has changed since it was cached.
+
+        lookup(DeckCache, str) --> str
+        """
+        key = os.path.abspath(filename)
+        stat = os.stat(filename)
+        index = self._load_index()
+        entry = index.get(key)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            path = self._deck_path(entry['hash'])
+        else:
+            #The file was touched or copied; it may still hold a cached deck.
+            digest = file_hash(filename)
+            path = self._deck_path(digest)
+            if not os.path.exists(path):
+                return None
+            index[key] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': digest}
+            self._save_index()
+        if not os.path.exists(path):
+            return None
+        os.utime(path, None)
+        return path
+
+    def store(self, filename, rows):
+        """Caches rows, the parsed (meaning, kanji, hiragana, image, audio)
+
+        cards of the deck filename, and returns the compiled deck's path.
+
+        store(DeckCache, str, list(tuple(str))) --> str
+        """
+        if not os.path.isdir(self._dir):
+            os.makedirs(self._dir)
+        stat = os.stat(filename)
+        digest = file_hash(filename)
+        path = self._deck_path(digest)
+        deckfile.write_deck(path + '.tmp', (Kanjicard(*row) for row in rows))
+        replace_file(path + '.tmp', path)
+        index = self._load_index()
+        index[os.path.abspath(filename)] = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                                            'hash': digest}
+        self._evict(keep=path)
+        self._save_index()
+        return path
+
+    def _evict(self, keep):
+        """Deletes least recently used compiled decks, other than keep, until
+
+        the cache fits in its bound, and drops their index entries.
+
+        _evict(DeckCache, str) --> void
+        """
+        decks = []
+        total = 0
+        for name in os.listdir(self._dir):
+            if name.endswith(deckfile.DECK_SUFFIX):
+                path = os.path.join(self._dir, name)
+                stat = os.stat(path)
+                decks.append((stat.st_mtime, path, stat.st_size))
+                total += stat.st_size
+        decks.sort()
+        removed = set()
+        for _, path, size in decks:
+            if total <= self._max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed.add(os.path.basename(path)[:-len(deckfile.DECK_SUFFIX)])
+        index = self._load_index()
+        for key in [key for key, entry in index.items() if entry['hash'] in removed]:
+            del index[key]
+
+    def clear(self):
+        """Deletes every cached deck.
+
+        clear(DeckCache) --> void
+        """
+        if os.path.isdir(self._dir):
+            for name in os.listdir(self._dir):
+                os.remove(os.path.join(self._dir, name))
+        self._index = {}
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compiled binary decks for Meikaichan.
+
+A compiled deck holds the same cards as a JSON deck but can be opened with
+mmap, so opening it costs the same whatever its size and only the cards
+actually shown are decoded. The layout, all integers little-endian, is:
+
+    header     magic "MKDK", version u16, reserved u16,
+               card count u32, string count u32, pool size u32
+    cards      per card five u32 string numbers:
+               meaning, kanji, hiragana, image, audio
+    strings    per string the u32 offset in the pool where it ends
+    pool       the UTF-8 text of every distinct string, back to back
+
+Usage:
+
+    python deckfile.py "Kanji 6.json" "Kanji 6.mkdeck" [--check]
+"""
+
+import sys
+import mmap
+import struct
+import argparse
+
+from cards import Kanjicard, Cardlist
+
+MAGIC = b'MKDK'
+VERSION = 1
+DECK_SUFFIX = '.mkdeck'
+
+HEADER = struct.Struct('<4sHHIII')
+CARD = struct.Struct('<5I')
+END = struct.Struct('<I')
+
+def is_deck(filename):
+    """Returns True if filename is a compiled deck.
+
+    is_deck(str) --> bool
+    """
+    with open(filename, 'rb') as fd:
+        return fd.read(len(MAGIC)) == MAGIC
+
+def write_deck(filename, cards):
+    """Writes cards, an iterable of Kanjicard, to filename as a compiled deck.
+
+    Returns the number of cards written.
+
+    write_deck(str, iterable(Kanjicard)) --> int
+    """
+    string_ids = {}
+    strings = []
+    records = []
+    for card in cards:
+        fields = (card.get_meaning(), card.get_kanji(), card.get_hiragana(),
+                  card.get_image(), card.get_audio())
+        record = []
+        for text in fields:
+            num = string_ids.get(text)
+            if num is None:
+                num = string_ids[text] = len(strings)
+                strings.append(text.encode('utf-8'))
+            record.append(num)
+        records.append(record)
+
+    pool = b''.join(strings)
+    with open(filename, 'wb') as fd:
+        fd.write(HEADER.pack(MAGIC, VERSION, 0, len(records), len(strings), len(pool)))
+        for record in records:
+            fd.write(CARD.pack(*record))
+        end = 0
+        for text in strings:
+            end += len(text)
+            fd.write(END.pack(end))
+        fd.write(pool)
+    return len(records)
+
+class MappedCardStore(object):
+
+    def __init__(self, filename):
+        """Opens the compiled deck filename as a read-only card store.
+
+        Only the header is read; cards are decoded as they are asked for.
+
+        __init__(MappedCardStore, str) --> void
+        """
+        self._filename = filename
+        with open(filename, 'rb') as fd:
+            self._map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self._count, nstrings, pool_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError("{0} is not a version {1} compiled deck".format(filename, VERSION))
+        self._cards = HEADER.size
+        self._ends = self._cards + self._count * CARD.size
+        self._pool = self._ends + nstrings * END.size
+        if self._pool + pool_size > len(self._map):
+            self._map.close()
+            raise ValueError("{0} is truncated".format(filename))
+
+    def _string(self, num):
+        """Returns string num of the pool.
+
+        _string(MappedCardStore, int) --> str
+        """
+        end = END.unpack_from(self._map, self._ends + num * END.size)[0]
+        start = END.unpack_from(self._map, self._ends + (num - 1) * END.size)[0] if num else 0
+        return self._map[self._pool + start:self._pool + end].decode('utf-8')
+
+    def _record(self, index):
+        """Returns the five string numbers of the card at index.
+
+        _record(MappedCardStore, int) --> tuple(int)
+        """
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("card index out of range")
+        return CARD.unpack_from(self._map, self._cards + index * CARD.size)
+
+    def get(self, index):
+        """Returns a Kanjicard view of the card at index.
+
+        get(MappedCardStore, int) --> Kanjicard
+        """
+        return Kanjicard(*[self._string(num) for num in self._record(index)])
+
+    def get_meaning(self, index):
+        """Returns the meaning of the card at index.
+
+        get_meaning(MappedCardStore, int) --> str
+        """
+        return self._string(self._record(index)[0])
+
+    def copy(self):
+        """Returns another mapping of the deck file, which stays open when
+
+        this one is closed.
+
+        copy(MappedCardStore) --> MappedCardStore
+        """
+        return MappedCardStore(self._filename)
+
+    def close(self):
+        """Unmaps the deck file.
+
+        close(MappedCardStore) --> void
+        """
+        self._map.close()
+
+    def __len__(self):
+        """Returns the number of cards in the deck.
+
+        __len__(MappedCardStore) --> int
+        """
+        return self._count
+
+def card_fields(card):
+    """Returns the fields of card as a tuple, for comparing cards.
+
+    card_fields(Kanjicard) --> tuple(str)
+    """
+    return (card.get_meaning(), card.get_kanji(), card.get_hiragana(),
+            card.get_image(), card.get_audio())
+
+def check_deck(source, compiled):
+    """Returns True if the compiled deck holds the same cards, in the same
+
+    order, as the JSON deck source.
+
+    check_deck(str, str) --> bool
+    """
+    expected = Cardlist()
+    expected.load_file(source)
+    actual = Cardlist()
+    actual.load_file(compiled)
+    if expected.length() != actual.length():
+        return False
+    for index in range(expected.length()):
+        if card_fields(expected.get_index(index)) != card_fields(actual.get_index(index)):
+            return False
+    return True
+
+def main(argv=None):
+    """Compiles a JSON deck into a binary deck.
+
+    main(list(str)) --> int
+    """
+    parser = argparse.ArgumentParser(description="Compile a Meikaichan JSON deck.")
+    parser.add_argument('source', help="JSON deck to compile")
+    parser.add_argument('target', nargs='?', help="compiled deck to write")
+    parser.add_argument('--check', action='store_true',
+                        help="check the compiled deck against the JSON loader")
+    args = parser.parse_args(argv)
+
+    target = args.target or args.source.rsplit('.', 1)[0] + DECK_SUFFIX
+    cards = Cardlist()
+    cards.load_file(args.source)
+    count = write_deck(target, (cards.get_index(i) for i in range(cards.length())))
+    print("Wrote {0} cards to {1}".format(count, target))
+    if args.check:
+        if not check_deck(args.source, target):
+            print("Round trip check failed")
+            return 1
+        print("Round trip check passed")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
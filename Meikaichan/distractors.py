@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""
+Distractor index for Meikaichan.
+
+The wrong answers offered in Meikai mode are drawn from cards that look
+like the card being asked: cards sharing one of its kanji, then cards whose
+reading has the same length, then cards whose meaning has a similar length.
+Cards are bucketed by these features once, as they are added, so drawing
+distinct, plausible distractors takes a bounded number of tries whatever
+the size of the deck. A large deck can be indexed a step at a time; until
+it is, distractors also come from cards picked at random.
+"""
+
+import random
+
+#Random tries made in each bucket before falling back to the next.
+TRIES_PER_BUCKET = 3
+
+#Decks up to this size are scanned when random tries find too few meanings.
+SCAN_LIMIT = 64
+
+#Meanings whose lengths fall in the same band of this width share a bucket.
+MEANING_BAND = 3
+
+def card_features(card):
+    """Returns the bucket keys of card, most plausible first.
+
+    card_features(Kanjicard) --> list(tuple)
+    """
+    features = [('kanji', char) for char in card.get_kanji()]
+    features.append(('reading', len(card.get_hiragana())))
+    features.append(('meaning', len(card.get_meaning()) // MEANING_BAND))
+    return features
+
+class DistractorIndex(object):
+
+    def __init__(self, rng=None):
+        """Initializes an empty index. rng defaults to the random module.
+
+        __init__(DistractorIndex, Random) --> void
+        """
+        self._rng = rng or random
+        self._buckets = {}
+        #Position of each card in its bucket, kept from the first removal
+        #from that bucket on so later removals are O(1).
+        self._places = {}
+        self._size = 0
+
+    def __len__(self):
+        """Returns the number of cards indexed.
+
+        __len__(DistractorIndex) --> int
+        """
+        return self._size
+
+    def add(self, index, card):
+        """Indexes card, found at index in the Cardlist.
+
+        add(DistractorIndex, int, Kanjicard) --> void
+        """
+        for feature in set(card_features(card)):
+            bucket = self._buckets.setdefault(feature, [])
+            bucket.append(index)
+            places = self._places.get(feature)
+            if places is not None:
+                places[index] = len(bucket) - 1
+        self._size = max(self._size, index + 1)
+
+    def extend(self, cardlist, limit=None):
+        """Indexes the cards added to cardlist since the last call, at most
+
+        limit of them if given. Returns True once every card is indexed.
+
+        extend(DistractorIndex, Cardlist, int) --> bool
+        """
+        length = cardlist.length()
+        stop = length if limit is None else min(length, self._size + limit)
+        for index in range(self._size, stop):
+            self.add(index, cardlist.get_index(index))
+        return self._size >= length
+
+    def remove(self, index, card):
+        """Removes card, found at index in the Cardlist, from the index.
+
+        remove(DistractorIndex, int, Kanjicard) --> void
+        """
+        for feature in set(card_features(card)):
+            bucket = self._buckets.get(feature)
+            if bucket is None:
+                continue
+            places = self._places.get(feature)
+            if places is None:
+                places = self._places[feature] = dict((num, pos) for pos, num in enumerate(bucket))
+            pos = places.pop(index, None)
+            if pos is None:
+                continue
+            #Move the last card of the bucket into the gap.
+            last = bucket.pop()
+            if pos < len(bucket):
+                bucket[pos] = last
+                places[last] = pos
+            if not bucket:
+                del self._buckets[feature]
+                del self._places[feature]
+
+    def resize(self, size):
+        """Sets the number of cards indexed to size, after the cards from
+
+        size on have been removed.
+
+        resize(DistractorIndex, int) --> void
+        """
+        self._size = size
+
+    def draw(self, cardlist, index, count=2):
+        """Returns count meanings of cards other than the one at index, all
+
+        different from each other and from its meaning when the deck allows.
+
+        draw(DistractorIndex, Cardlist, int, int) --> list(str)
+        """
+        rng = self._rng
+        card = cardlist.get_index(index)
+        taken = set([card.get_meaning()])
+        chosen = []
+
+        def offer(candidate):
+            meaning = cardlist.get_meaning(candidate)
+            if meaning not in taken:
+                taken.add(meaning)
+                chosen.append(meaning)
+
+        features = card_features(card)
+        kanji, rest = features[:-2], features[-2:]
+        rng.shuffle(kanji)
+        for feature in kanji + rest:
+            bucket = self._buckets.get(feature, ())
+            if len(bucket) < 2:
+                continue
+            for _ in range(TRIES_PER_BUCKET):
+                if len(chosen) == count:
+                    return chosen
+                offer(bucket[rng.randint(0, len(bucket) - 1)])
+
+        #Fall back to any card, then to duplicates if the deck is too small.
+        length = cardlist.length()
+        for _ in range(TRIES_PER_BUCKET * count):
+            if len(chosen) == count:
+                return chosen
+            offer(rng.randint(0, length - 1))
+        if length <= SCAN_LIMIT:
+            for candidate in range(length):
+                if len(chosen) == count:
+                    return chosen
+                offer(candidate)
+        while len(chosen) < count:
+            chosen.append(cardlist.get_meaning(rng.randint(0, length - 1)))
+        return chosen
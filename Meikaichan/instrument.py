@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+"""
+Hot-path instrumentation for Meikaichan.
+
+Stages such as loading a deck, choosing a card, decoding an image or
+grading an answer are timed with the measure context manager or the timed
+decorator. Timing is off by default and costs one attribute check per call
+until enable is called. Each stage keeps a count, a total and a ring of its
+last SAMPLES durations, from which the report takes percentiles.
+
+    from instrument import measure, timed
+
+    @timed('check_answer')
+    def check_answer(self, text):
+        ...
+
+    with measure('select'):
+        num = self._selector.draw()
+"""
+
+import os
+import sys
+import threading
+from array import array
+
+from timers import monotonic
+
+#Durations kept per stage for percentiles.
+SAMPLES = 4096
+PERCENTILES = (50, 90, 99)
+
+TIMINGS_FILE = os.path.join(os.path.expanduser('~'), '.meikaichan', 'timings.txt')
+PROFILE_FILE = os.path.join(os.path.expanduser('~'), '.meikaichan', 'session.prof')
+
+class Stage(object):
+
+    def __init__(self, name):
+        """Initializes the counters of the stage name.
+
+        __init__(Stage, str) --> void
+        """
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self._samples = array('d')
+
+    def add(self, seconds):
+        """Records one run of the stage taking seconds.
+
+        add(Stage, float) --> void
+        """
+        if len(self._samples) < SAMPLES:
+            self._samples.append(seconds)
+        else:
+            self._samples[self.count % SAMPLES] = seconds
+        self.count += 1
+        self.total += seconds
+        if seconds > self.worst:
+            self.worst = seconds
+
+    def percentile(self, percentile):
+        """Returns the nearest-rank percentile of the recent durations.
+
+        percentile(Stage, int) --> float
+        """
+        samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        rank = max(0, min(len(samples) - 1, -(-percentile * len(samples) // 100) - 1))
+        return samples[rank]
+
+class Instruments(object):
+
+    def __init__(self):
+        """Initializes a disabled set of stage counters.
+
+        __init__(Instruments) --> void
+        """
+        self.enabled = False
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        """Records one run of the stage name taking seconds.
+
+        record(Instruments, str, float) --> void
+        """
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = Stage(name)
+            stage.add(seconds)
+
+    def get_stages(self):
+        """Returns the stages recorded so far, by name.
+
+        get_stages(Instruments) --> list(Stage)
+        """
+        with self._lock:
+            return [self._stages[name] for name in sorted(self._stages)]
+
+    def clear(self):
+        """Forgets every recorded duration.
+
+        clear(Instruments) --> void
+        """
+        with self._lock:
+            self._stages.clear()
+
+    def report(self):
+        """Returns a table of every stage: runs, total and mean time,
+
+        percentiles of the recent runs and the slowest run, in milliseconds.
+
+        report(Instruments) --> str
+        """
+        header = "".join("{0:>9}".format("p{0}".format(p)) for p in PERCENTILES)
+        lines = ["{0:<16}{1:>8}{2:>11}{3:>9}{4}{5:>9}".format(
+            "stage", "count", "total", "mean", header, "max")]
+        for stage in self.get_stages():
+            lines.append("{0:<16}{1:>8}{2:>11.1f}{3:>9.2f}{4}{5:>9.2f}".format(
+                stage.name, stage.count, stage.total * 1000, stage.total * 1000 / stage.count,
+                "".join("{0:>9.2f}".format(stage.percentile(p) * 1000) for p in PERCENTILES),
+                stage.worst * 1000))
+        return "\n".join(lines)
+
+    def dump(self, filename=TIMINGS_FILE):
+        """Writes the report to filename, if anything was recorded.
+
+        dump(Instruments, str) --> void
+        """
+        if not self._stages:
+            return
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(filename, 'w') as fd:
+            fd.write(self.report() + "\n")
+
+INSTRUMENTS = Instruments()
+
+class _Measure(object):
+    """Context manager recording the time its block takes under a stage."""
+
+    __slots__ = ('_name', '_start')
+
+    def __init__(self, name):
+        self._name = name
+        self._start = monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        INSTRUMENTS.record(self._name, monotonic() - self._start)
+        return False
+
+class _Idle(object):
+    """Context manager doing nothing, used while timing is off."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+IDLE = _Idle()
+
+def measure(name):
+    """Returns a context manager timing its block as the stage name.
+
+    measure(str) --> context manager
+    """
+    if INSTRUMENTS.enabled:
+        return _Measure(name)
+    return IDLE
+
+def timed(name):
+    """Returns a decorator timing each call of a function as the stage name.
+
+    timed(str) --> callable
+    """
+    def decorate(function):
+        def wrapper(*args, **kwargs):
+            if not INSTRUMENTS.enabled:
+                return function(*args, **kwargs)
+            start = monotonic()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                INSTRUMENTS.record(name, monotonic() - start)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+    return decorate
+
+def enable():
+    """Turns timing on.
+
+    enable() --> void
+    """
+    INSTRUMENTS.enabled = True
+
+def disable():
+    """Turns timing off. Recorded durations are kept.
+
+    disable() --> void
+    """
+    INSTRUMENTS.enabled = False
+
+def toggle():
+    """Turns timing on if it was off and off if it was on, and returns
+
+    whether it is now on.
+
+    toggle() --> bool
+    """
+    INSTRUMENTS.enabled = not INSTRUMENTS.enabled
+    return INSTRUMENTS.enabled
+
+def profile(function, filename=PROFILE_FILE):
+    """Runs function under cProfile and writes the statistics to filename,
+
+    to be read with pstats or a viewer such as snakeviz.
+
+    profile(callable, str) --> object
+    """
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function)
+    finally:
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        profiler.dump_stats(filename)
+        sys.stderr.write("Profile written to {0}\n".format(filename))
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+Load generator for the Meikaichan quiz server.
+
+Simulates many learners against server.py for a fixed time. Each learner
+starts a session, answers questions, now and then fetches a card's image
+as a browser would, and starts over when its deck is complete. Learners
+share a pool of keep-alive connections, so thousands can be simulated
+without thousands of sockets. Reports requests per second and latency
+percentiles per kind of request, which include the time spent waiting for
+a free connection, and that wait on its own. Requires Python 3.5 or
+later.
+
+Usage:
+
+    python loadgen.py [--port 8080] [--learners 2000] [--connections 64]
+                      [--duration 10] [--output results.json]
+"""
+
+import sys
+import json
+import random
+import asyncio
+import argparse
+
+from quiz import MODES, MEIKAI
+from timers import monotonic
+from server import HOST, PORT
+
+PERCENTILES = (50, 90, 99)
+
+#Wrong answers typed by simulated learners.
+GUESSES = ('fire', 'water', 'tree', 'gold', 'かね', 'ひ')
+
+class Pool(object):
+
+    def __init__(self, host, port, size):
+        """Initializes a pool of size connections to host and port.
+
+        __init__(Pool, str, int, int) --> void
+        """
+        self._host = host
+        self._port = port
+        self._size = size
+        self._idle = asyncio.Queue()
+        self.latencies = {}
+        self.errors = 0
+
+    async def open(self):
+        """Opens the connections.
+
+        open(Pool) --> void
+        """
+        for _ in range(self._size):
+            self._idle.put_nowait(await asyncio.open_connection(self._host, self._port))
+
+    async def close(self):
+        """Closes the idle connections.
+
+        close(Pool) --> void
+        """
+        while not self._idle.empty():
+            reader, writer = self._idle.get_nowait()
+            writer.close()
+
+    async def request(self, kind, method, path, data=None, headers=()):
+        """Sends a request on a free connection and returns its status,
+
+        headers and body. Its latency, including any wait for a connection,
+        is recorded under kind and the wait alone under 'queue'.
+
+        request(Pool, str, str, str, dict, tuple) --> (int, dict, bytes)
+        """
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        head = ['{0} {1} HTTP/1.1'.format(method, path), 'Host: {0}'.format(self._host),
+                'Content-Length: {0}'.format(len(body))]
+        head.extend('{0}: {1}'.format(name, value) for name, value in headers)
+        #Time from before a connection is free, so waiting for one counts.
+        queued = monotonic()
+        reader, writer = await self._idle.get()
+        start = monotonic()
+        self.latencies.setdefault('queue', []).append(start - queued)
+        try:
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+            response = await reader.readuntil(b'\r\n\r\n')
+            lines = response.decode('latin-1').split('\r\n')
+            status = int(lines[0].split(' ', 2)[1])
+            received = {}
+            for line in lines[1:]:
+                name, sep, value = line.partition(':')
+                if sep:
+                    received[name.strip().lower()] = value.strip()
+            length = int(received.get('content-length', 0))
+            payload = await reader.readexactly(length) if length else b''
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            #Replace the broken connection.
+            writer.close()
+            self.errors += 1
+            self._idle.put_nowait(await asyncio.open_connection(self._host, self._port))
+            return None, {}, b''
+        self.latencies.setdefault(kind, []).append(monotonic() - queued)
+        self._idle.put_nowait((reader, writer))
+        #Let a learner already waiting take the connection before this one
+        #asks for it again.
+        await asyncio.sleep(0)
+        if status >= 400:
+            self.errors += 1
+        return status, received, payload
+
+async def learner(pool, mode, deadline, rng, asset_rate):
+    """Runs one simulated learner in mode until deadline.
+
+    learner(Pool, str, float, Random, float) --> void
+    """
+    etags = {}
+    while monotonic() < deadline:
+        status, _, body = await pool.request('start', 'POST', '/sessions', {'mode': mode})
+        if status != 201:
+            return
+        state = json.loads(body.decode('utf-8'))
+        key = state['session']
+        while monotonic() < deadline and state.get('question'):
+            question = state['question']
+            if rng.random() < asset_rate:
+                image = question['image']
+                headers = (('If-None-Match', etags[image]),) if image in etags else ()
+                status, received, _ = await pool.request('asset', 'GET', image, headers=headers)
+                if 'etag' in received:
+                    etags[image] = received['etag']
+            if mode == MEIKAI:
+                answer = rng.choice(question['choices'])
+            else:
+                answer = rng.choice(GUESSES)
+            status, _, body = await pool.request('answer', 'POST', '/sessions/{0}/answer'.format(key),
+                                              {'answer': answer})
+            if status != 200:
+                break
+            state = json.loads(body.decode('utf-8'))
+        await pool.request('end', 'DELETE', '/sessions/{0}'.format(key))
+
+def summary(samples, seconds):
+    """Returns the count, rate and latency percentiles of samples, in ms.
+
+    summary(list(float), float) --> dict
+    """
+    samples = sorted(samples)
+    count = len(samples)
+    result = {'count': count, 'per_second': count / seconds}
+    if count:
+        for percentile in PERCENTILES:
+            result['p{0}_ms'.format(percentile)] = samples[max(0, -(-percentile * count // 100) - 1)] * 1000
+        result['max_ms'] = samples[-1] * 1000
+    return result
+
+async def run(host=HOST, port=PORT, learners=2000, connections=64, duration=10.0,
+              asset_rate=0.1, seed=1):
+    """Simulates learners for duration seconds and returns the results.
+
+    run(str, int, int, int, float, float, int) --> dict
+    """
+    pool = Pool(host, port, connections)
+    await pool.open()
+    rng = random.Random(seed)
+    start = monotonic()
+    deadline = start + duration
+    tasks = [learner(pool, MODES[index % len(MODES)], deadline, random.Random(rng.random()), asset_rate)
+             for index in range(learners)]
+    await asyncio.gather(*tasks)
+    elapsed = monotonic() - start
+    await pool.close()
+    everything = [sample for kind, samples in pool.latencies.items() if kind != 'queue'
+                  for sample in samples]
+    results = {'learners': learners, 'connections': connections, 'seconds': elapsed,
+               'errors': pool.errors, 'all': summary(everything, elapsed)}
+    for kind, samples in pool.latencies.items():
+        results[kind] = summary(samples, elapsed)
+    return results
+
+def main(argv=None):
+    """Runs the load generator and prints its results.
+
+    main(list(str)) --> int
+    """
+    parser = argparse.ArgumentParser(description="Load test the Meikaichan quiz server.")
+    parser.add_argument('--host', default=HOST, help="server address")
+    parser.add_argument('--port', type=int, default=PORT, help="server port")
+    parser.add_argument('--learners', type=int, default=2000, help="simulated learners")
+    parser.add_argument('--connections', type=int, default=64, help="connections shared by the learners")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds to run for")
+    parser.add_argument('--asset-rate', type=float, default=0.1,
+                        help="fraction of questions whose image is fetched")
+    parser.add_argument('--seed', type=int, default=1, help="seed for the learners' answers")
+    parser.add_argument('--output', help="file to write the JSON results to")
+    args = parser.parse_args(argv)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results = loop.run_until_complete(run(args.host, args.port, args.learners, args.connections,
+                                          args.duration, args.asset_rate, args.seed))
+    for kind in sorted(results):
+        if isinstance(results[kind], dict):
+            line = "  ".join("{0} {1:.1f}".format(name, value) for name, value in sorted(results[kind].items()))
+            sys.stdout.write("{0:<8}{1}\n".format(kind, line))
+    sys.stdout.write("errors  {0}\n".format(results['errors']))
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+Card lookup for Meikaichan.
+
+CardLookup indexes a Cardlist by reading and by kanji: a trie over the
+hiragana of every card answers "readings starting with かん" by walking the
+prefix and collecting the subtree, and an inverted index from each kanji
+character to the cards containing it answers "cards containing 金". Neither
+query looks at cards outside its answer, so both stay instant on decks of
+hundreds of thousands of cards.
+"""
+
+from answers import normalize
+
+#Key under which a trie node keeps the cards whose reading ends there.
+CARDS = ''
+
+def is_kana(text):
+    """Returns True if text is made only of hiragana and katakana.
+
+    is_kana(str) --> bool
+    """
+    return bool(text) and all(u'\u3040' <= char <= u'\u30ff' for char in text)
+
+class CardLookup(object):
+
+    def __init__(self):
+        """Initializes an empty lookup.
+
+        __init__(CardLookup) --> void
+        """
+        self._trie = {}
+        self._kanji = {}
+        self._size = 0
+
+    def __len__(self):
+        """Returns the number of cards indexed.
+
+        __len__(CardLookup) --> int
+        """
+        return self._size
+
+    def add(self, index, card):
+        """Indexes card, found at index in the Cardlist.
+
+        add(CardLookup, int, Kanjicard) --> void
+        """
+        node = self._trie
+        for char in normalize(card.get_hiragana()):
+            node = node.setdefault(char, {})
+        node.setdefault(CARDS, []).append(index)
+        for char in set(card.get_kanji()):
+            if not is_kana(char):
+                self._kanji.setdefault(char, []).append(index)
+        self._size = max(self._size, index + 1)
+
+    def remove(self, index, card):
+        """Removes card, found at index in the Cardlist, from the lookup.
+
+        remove(CardLookup, int, Kanjicard) --> void
+        """
+        node = self._trie
+        for char in normalize(card.get_hiragana()):
+            node = node.get(char)
+            if node is None:
+                break
+        else:
+            if index in node.get(CARDS, ()):
+                node[CARDS].remove(index)
+        for char in set(card.get_kanji()):
+            indexes = self._kanji.get(char)
+            if indexes is not None and index in indexes:
+                indexes.remove(index)
+
+    def extend(self, cardlist):
+        """Indexes the cards added to cardlist since the last call.
+
+        extend(CardLookup, Cardlist) --> void
+        """
+        for index in range(self._size, cardlist.length()):
+            self.add(index, cardlist.get_index(index))
+
+    def resize(self, size):
+        """Sets the number of cards indexed to size, after the cards from
+
+        size on have been removed.
+
+        resize(CardLookup, int) --> void
+        """
+        self._size = size
+
+    def find_reading(self, prefix):
+        """Returns the sorted indexes of the cards whose reading starts with
+
+        prefix, which may be given in katakana.
+
+        find_reading(CardLookup, str) --> list(int)
+        """
+        node = self._trie
+        for char in normalize(prefix):
+            node = node.get(char)
+            if node is None:
+                return []
+        found = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for char, child in node.items():
+                if char == CARDS:
+                    found.extend(child)
+                else:
+                    stack.append(child)
+        found.sort()
+        return found
+
+    def find_kanji(self, chars):
+        """Returns the sorted indexes of the cards containing every kanji in
+
+        chars. Kana in chars are ignored.
+
+        find_kanji(CardLookup, str) --> list(int)
+        """
+        postings = [self._kanji.get(char, []) for char in set(chars) if not is_kana(char)]
+        if not postings:
+            return []
+        postings.sort(key=len)
+        found = set(postings[0])
+        for indexes in postings[1:]:
+            found.intersection_update(indexes)
+            if not found:
+                break
+        return sorted(found)
@@ -0,0 +1,574 @@
+# -*- coding: utf-8 -*-
+
+"""
+Quiz engine for Meikaichan.
+
+QuizSession runs a Meikai, Seikai or Reikai drill over a Cardlist without
+touching Tkinter or pygame. Whatever needs to be drawn or played is handed
+to a renderer and an audio sink, so the same session can drive the Tk
+Controller, a batch drill, or a throughput test. Given a ReviewScheduler the
+session asks due cards first and feeds every grade back into the schedule,
+and given a recorder such as a ReviewLog it records every graded answer.
+"""
+
+import random
+from collections import deque
+
+from srs import QUALITY_CORRECT, QUALITY_WRONG, QUALITY_TIMEOUT
+from timers import monotonic
+from distractors import DistractorIndex
+from answers import AnswerIndex
+from instrument import measure
+from cards import replay_changes
+
+#Quiz modes.
+MEIKAI = 'meikai'
+SEIKAI = 'seikai'
+REIKAI = 'reikai'
+MODES = (MEIKAI, SEIKAI, REIKAI)
+
+#Correct answers needed to complete a deck.
+DECK_GOAL = 30
+
+#Seconds given to answer a card.
+ANSWER_SECONDS = 20
+
+#Number of recently shown cards kept out of the draw.
+DISPLAYED_WINDOW = 29
+
+#Cards indexed for Meikai distractors per question asked or prepare call.
+INDEX_STEP = 1000
+
+#Feedback clips played after an answer is graded.
+CORRECT_SOUND = 'sound/seikai.mp3'
+WRONG_SOUNDS = {
+    MEIKAI: 'sound/chigau.mp3',
+    SEIKAI: 'sound/aho.mp3',
+    REIKAI: 'sound/shikkari.mp3',
+    }
+
+
+class Question(object):
+
+    def __init__(self, index, card, choices):
+        """Initializes a Question for the card at index in the Cardlist.
+
+        choices are the meanings offered on the Meikai buttons, in order,
+        and empty in the other modes.
+
+        __init__(Question, int, Kanjicard, list(str)) --> void
+        """
+        self.index = index
+        self.card = card
+        self.choices = choices
+
+
+class CardSelector(object):
+
+    def __init__(self, size, window=DISPLAYED_WINDOW, rng=None):
+        """Initializes a selector drawing card indexes 0..size-1.
+
+        A card drawn is kept out of the next window draws. The window is
+        clamped to size-1 so small decks still cycle through every card.
+
+        __init__(CardSelector, int, int, Random) --> void
+        """
+        self._rng = rng or random
+        self._window = window
+        self.reset(size)
+
+    def reset(self, size):
+        """Forgets the recently drawn cards and draws from 0..size-1.
+
+        reset(CardSelector, int) --> void
+        """
+        self._moved = {}
+        self._length = size
+        self._recent = deque()
+        self._size = size
+        self._next = None
+
+    def extend(self, size):
+        """Grows the selector to draw from 0..size-1, keeping the recent window.
+
+        extend(CardSelector, int) --> void
+        """
+        if self._length == self._size:
+            #The new indexes sit at their own positions in the pool.
+            self._length += max(0, size - self._size)
+        else:
+            for index in range(self._size, size):
+                self._push(index)
+        self._size = max(self._size, size)
+
+    def get_window(self):
+        """Returns the effective no-repeat window.
+
+        get_window(CardSelector) --> int
+        """
+        return max(0, min(self._window, self._size - 1))
+
+    def peek(self):
+        """Returns the index the next draw will return, choosing it now.
+
+        peek(CardSelector) --> int
+        """
+        if self._next is None:
+            self._next = self._choose()
+        return self._next
+
+    def draw(self):
+        """Returns a random index not drawn in the last window draws.
+
+        draw(CardSelector) --> int
+        """
+        index = self._next
+        if index is None:
+            index = self._choose()
+        self._next = None
+        return index
+
+    def _choose(self):
+        """Chooses a random index not drawn in the last window draws.
+
+        The pool holds the indexes outside the window. A draw swaps a random
+        pool entry with the last one and pops it, and the oldest recent index
+        goes back in the pool, so a draw costs O(1) whatever the deck size.
+        The pool is stored sparsely: position i holds index i unless _moved
+        says otherwise, so a fresh selector takes no memory per card.
+
+        _choose(CardSelector) --> int
+        """
+        if not self._size:
+            raise IndexError("draw from an empty deck")
+        moved = self._moved
+        recent = self._recent
+        while len(recent) > self.get_window():
+            self._push(recent.popleft())
+        pos = self._rng.randint(0, self._length - 1)
+        last = self._length - 1
+        index = moved.get(pos, pos)
+        if pos != last:
+            moved[pos] = moved.get(last, last)
+        moved.pop(last, None)
+        self._length = last
+        recent.append(index)
+        return index
+
+    def remap(self, size, mapping):
+        """Moves the selector onto a deck of size cards after cards were
+
+        removed or moved: mapping gives the new index of each old index that
+        changed, or None for removed cards. Recently drawn cards stay out of
+        the next draws under their new indexes.
+
+        remap(CardSelector, int, dict) --> void
+        """
+        recent = []
+        for index in self._recent:
+            index = mapping.get(index, index)
+            if index is not None and index < size:
+                recent.append(index)
+        upcoming = self._next
+        self.reset(size)
+        #Take the recent indexes out of the fresh pool, tracking where
+        #the entries swapped into their places went.
+        where = {}
+        for index in recent:
+            pos = where.get(index, index)
+            last = self._length - 1
+            value = self._moved.get(last, last)
+            if pos != last:
+                self._moved[pos] = value
+                where[value] = pos
+            self._moved.pop(last, None)
+            self._length = last
+            self._recent.append(index)
+        if upcoming is not None:
+            self._next = mapping.get(upcoming, upcoming)
+
+    def _push(self, index):
+        """Puts index back at the end of the pool.
+
+        _push(CardSelector, int) --> void
+        """
+        self._moved[self._length] = index
+        self._length += 1
+
+
+class NullRenderer(object):
+    """Renderer that draws nothing. Used when a session runs headless."""
+
+    def show_question(self, question):
+        """Displays a new question.
+
+        show_question(NullRenderer, Question) --> void
+        """
+        pass
+
+    def show_verdict(self, question, correct):
+        """Displays the result of grading question.
+
+        show_verdict(NullRenderer, Question, bool) --> void
+        """
+        pass
+
+
+class NullAudio(object):
+    """Audio sink that plays nothing. Used when a session runs headless."""
+
+    def play(self, path):
+        """Plays the audio file at path.
+
+        play(NullAudio, str) --> void
+        """
+        pass
+
+    def prefetch(self, path):
+        """Prepares the audio file at path to be played soon.
+
+        prefetch(NullAudio, str) --> void
+        """
+        pass
+
+
+class QuizSession(object):
+
+    def __init__(self, cardlist, mode=MEIKAI, renderer=None, audio=None, rng=None,
+                 window=DISPLAYED_WINDOW, scheduler=None, recorder=None,
+                 distractors=None, answers=None):
+        """Initializes a session drilling the cards of cardlist in mode.
+
+        renderer and audio default to sinks that do nothing; rng defaults to
+        the random module. A card is not asked again within window questions,
+        unless scheduler, a ReviewScheduler, has it due. recorder, e.g. a
+        ReviewLog, is told about every graded answer. distractors and answers
+        may be a DistractorIndex and AnswerIndex shared by sessions over the
+        same Cardlist; by default the session builds its own.
+
+        __init__(QuizSession, Cardlist, str, renderer, audio, Random, int,
+                 ReviewScheduler, recorder, DistractorIndex, AnswerIndex) --> void
+        """
+        self._items = cardlist
+        self._renderer = renderer or NullRenderer()
+        self._audio = audio or NullAudio()
+        self._rng = rng or random
+        self._selector = CardSelector(cardlist.length(), window, self._rng)
+        self._distractors = DistractorIndex(self._rng) if distractors is None else distractors
+        self._answers = AnswerIndex() if answers is None else answers
+        self._scheduler = scheduler
+        self._recorder = recorder
+        self._drill = None
+        self._question = None
+        self._asked = None
+        self.set_mode(mode)
+
+    def set_mode(self, mode):
+        """Switches the session to mode and resets the counters.
+
+        set_mode(QuizSession, str) --> void
+        """
+        if mode not in MODES:
+            raise ValueError("Unknown quiz mode: {0}".format(mode))
+        self._mode = mode
+        self.reset()
+
+    def get_mode(self):
+        """Returns the current quiz mode.
+
+        get_mode(QuizSession) --> str
+        """
+        return self._mode
+
+    def reset(self):
+        """Resets the attempt and correct answer counts.
+
+        reset(QuizSession) --> void
+        """
+        self._attempts = 0
+        self._correct = 0
+
+    def get_attempts(self):
+        """Returns the number of graded attempts.
+
+        get_attempts(QuizSession) --> int
+        """
+        return self._attempts
+
+    def get_correct(self):
+        """Returns the number of correct answers.
+
+        get_correct(QuizSession) --> int
+        """
+        return self._correct
+
+    def get_question(self):
+        """Returns the question currently being asked, or None.
+
+        get_question(QuizSession) --> Question
+        """
+        return self._question
+
+    def is_complete(self):
+        """Returns True once DECK_GOAL correct answers have been given.
+
+        is_complete(QuizSession) --> bool
+        """
+        return self._correct >= DECK_GOAL
+
+    def set_drill(self, indexes):
+        """Restricts the questions to the cards at indexes, e.g. the result
+
+        of Cardlist.find_reading, or lifts the restriction if indexes is None.
+        While drilling the schedule is not consulted: the drill set is asked
+        in random order, whether or not its cards are due.
+
+        set_drill(QuizSession, list(int)) --> void
+        """
+        if indexes is None:
+            self._drill = None
+            self._selector.reset(self._items.length())
+            return
+        if not indexes:
+            raise ValueError("no cards to drill")
+        self._drill = list(indexes)
+        self._selector.reset(len(self._drill))
+
+    def get_drill(self):
+        """Returns the indexes of the active drill set, or None.
+
+        get_drill(QuizSession) --> list(int)
+        """
+        return self._drill
+
+    def restart(self):
+        """Starts over after the cards of the Cardlist were replaced, e.g. by
+
+        another deck: the counters and drill set are reset and the indexes
+        rebuilt by prepare and as questions are asked.
+
+        restart(QuizSession) --> void
+        """
+        self._selector.reset(self._items.length())
+        self._distractors = DistractorIndex(self._rng)
+        self._answers = AnswerIndex()
+        self._drill = None
+        self._question = None
+        self.reset()
+
+    def apply_changes(self, changes):
+        """Brings the session up to date with changes made to its Cardlist
+
+        by Cardlist.reload_file. The counters are kept, as are the recently
+        shown cards still in the deck.
+
+        Returns True if the card of the current question was updated or
+        removed, so the question shown is out of date.
+
+        apply_changes(QuizSession, list(tuple)) --> bool
+        """
+        size = self._items.length()
+        added = sum(1 for change in changes if change[0] == 'add')
+        removed = sum(1 for change in changes if change[0] == 'remove')
+        updated = set(change[1] for change in changes if change[0] == 'update')
+        old = size - added + removed
+
+        #Follow each card from its index before the changes to its new one,
+        #or None if it was removed.
+        mapping = {}
+        origin = {}
+        for change in changes:
+            if change[0] == 'remove':
+                mapping[origin.pop(change[1], change[1])] = None
+            elif change[0] == 'move':
+                first = origin.pop(change[1], change[1])
+                origin[change[2]] = first
+                mapping[first] = change[2]
+
+        #A distractor index not yet covering every card is started over, as
+        #it indexes cards in order; answers are indexed card by card.
+        if len(self._distractors) == old:
+            replay_changes(self._distractors, changes, size)
+        else:
+            self._distractors = DistractorIndex(self._rng)
+        replay_changes(self._answers, changes, size)
+
+        if self._drill is not None:
+            drill = []
+            positions = {}
+            for pos, index in enumerate(self._drill):
+                index = mapping.get(index, index)
+                if index is None:
+                    positions[pos] = None
+                    continue
+                if pos != len(drill):
+                    positions[pos] = len(drill)
+                drill.append(index)
+            if drill:
+                self._drill = drill
+                self._selector.remap(len(drill), positions)
+            else:
+                self.set_drill(None)
+        elif mapping:
+            self._selector.remap(size, mapping)
+
+        question = self._question
+        if question is None:
+            return False
+        index = mapping.get(question.index, question.index)
+        if index is None:
+            return True
+        affected = question.index in updated
+        question.index = index
+        return affected
+
+    def next_question(self):
+        """Asks the most overdue card of the schedule, or else a card not
+
+        recently displayed.
+
+        next_question(QuizSession) --> Question
+        """
+        rng = self._rng
+        length = self._items.length()
+
+        with measure('select'):
+            if self._drill is not None:
+                num = self._drill[self._selector.draw()]
+            else:
+                num = self._due_index()
+                if num is None:
+                    #Cards may have been loaded into the Cardlist since the last question.
+                    self._selector.extend(length)
+                    num = self._selector.draw()
+            kj_card = self._items.get_index(num)
+
+            #In Meikai mode pick two distinct, plausible incorrect answers and
+            #shuffle them in with the correct one. The index of a large deck
+            #is built a step per question, or between questions by prepare.
+            choices = []
+            if self._mode == MEIKAI:
+                self._distractors.extend(self._items, INDEX_STEP)
+                answer2, answer3 = self._distractors.draw(self._items, num)
+                alist = [kj_card.get_meaning(), answer2, answer3]
+                choices.append(alist.pop(rng.randint(0, 2)))
+                choices.append(alist.pop(rng.randint(0, 1)))
+                choices.append(alist[0])
+
+        self._question = Question(num, kj_card, choices)
+        self._asked = monotonic()
+        self._renderer.show_question(self._question)
+
+        #Get the audio of this card and the one after it ready to play.
+        self._audio.prefetch(kj_card.get_audio())
+        upcoming = self._selector.peek()
+        if self._drill is not None:
+            upcoming = self._drill[upcoming]
+        self._audio.prefetch(self._items.get_index(upcoming).get_audio())
+        return self._question
+
+    def prepare(self, steps=INDEX_STEP):
+        """Indexes at most steps more cards for the distractors of Meikai
+
+        mode, so that it need not be done while a question is asked. Returns
+        True once nothing is left to index for the current mode.
+
+        prepare(QuizSession, int) --> bool
+        """
+        if self._mode != MEIKAI:
+            return True
+        return self._distractors.extend(self._items, steps)
+
+    def _due_index(self):
+        """Returns the index of the most overdue scheduled card, or None.
+
+        Scheduled cards no longer in the Cardlist are dropped.
+
+        _due_index(QuizSession) --> int
+        """
+        if self._scheduler is None:
+            return None
+        while True:
+            meaning = self._scheduler.next_due()
+            if meaning is None:
+                return None
+            num = self._items.index_of(meaning)
+            if num is not None:
+                return num
+            self._scheduler.discard(meaning)
+
+    def grade(self, text):
+        """Returns True if text answers the current question in this mode.
+
+        Meikai compares the chosen meaning. Seikai matches the typed meaning
+        and Reikai the typed reading in canonical form, allowing synonyms
+        and a typo in long answers (see answers.py).
+
+        grade(QuizSession, str) --> bool
+        """
+        question = self._question
+        if self._mode == MEIKAI:
+            return question.card.get_meaning() == text
+        #The answers of a card are indexed when it is first graded.
+        if not self._answers.has(question.index):
+            self._answers.add(question.index, question.card)
+        if self._mode == SEIKAI:
+            return self._answers.check_meaning(question.index, text)
+        return self._answers.check_reading(question.index, text)
+
+    def submit(self, text):
+        """Grades text as an attempt at the current question.
+
+        Updates the counters, plays the feedback clip and shows the verdict.
+
+        submit(QuizSession, str) --> bool
+        """
+        correct = self.grade(text)
+        self._attempts += 1
+        if correct:
+            self._correct += 1
+        self._review(QUALITY_CORRECT if correct else QUALITY_WRONG, text, correct)
+        self._verdict(correct)
+        return correct
+
+    def expire(self):
+        """Marks the current question wrong when its time runs out.
+
+        Unlike submit this does not count as an attempt.
+
+        expire(QuizSession) --> void
+        """
+        self._review(QUALITY_TIMEOUT, u'', False)
+        self._verdict(False)
+
+    def _review(self, quality, text, correct):
+        """Reports the answer text and its quality to the schedule and the
+
+        recorder, if any.
+
+        _review(QuizSession, int, str, bool) --> void
+        """
+        meaning = self._question.card.get_meaning()
+        if self._scheduler is not None:
+            self._scheduler.review(meaning, quality)
+        if self._recorder is not None:
+            elapsed = int((monotonic() - self._asked) * 1000)
+            self._recorder.record(meaning, self._mode, text, correct, elapsed)
+
+    def _verdict(self, correct):
+        """Plays the feedback clip and shows the verdict.
+
+        _verdict(QuizSession, bool) --> void
+        """
+        if correct:
+            self._audio.play(CORRECT_SOUND)
+        else:
+            self._audio.play(WRONG_SOUNDS[self._mode])
+        self._renderer.show_verdict(self._question, correct)
+
+    def play_audio(self):
+        """Plays the audio file of the current card.
+
+        play_audio(QuizSession) --> void
+        """
+        self._audio.play(self._question.card.get_audio())
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+"""
+Review log for Meikaichan.
+
+Every graded answer is recorded in a local SQLite database: the card, the
+quiz mode, the answer given, whether it was correct and how long it took.
+Records are queued and written by a background thread in batched
+transactions, so grading never waits on the disk. The database runs in WAL
+mode so a crash loses at most the batch not yet flushed.
+
+If the database cannot be opened, ReviewLog raises and the app runs
+without a log. A batch that fails to be written is dropped and the error
+kept in get_error; later answers are still written.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+REVIEW_DB = os.path.join(os.path.expanduser('~'), '.meikaichan', 'reviews.db')
+
+#Records written per transaction, and seconds a record may wait to be written.
+BATCH_SIZE = 256
+FLUSH_INTERVAL = 2.0
+
+#Seconds to wait for the database to open.
+OPEN_TIMEOUT = 10.0
+
+DAY = 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reviews (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    day INTEGER NOT NULL,
+    card TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    correct INTEGER NOT NULL,
+    response_ms INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reviews_card ON reviews (card, time);
+CREATE INDEX IF NOT EXISTS reviews_day ON reviews (day, mode);
+"""
+
+INSERT = ("INSERT INTO reviews (time, day, card, mode, answer, correct, response_ms) "
+          "VALUES (?, ?, ?, ?, ?, ?, ?)")
+
+def connect(filename):
+    """Opens the review database filename, creating its schema if needed.
+
+    connect(str) --> sqlite3.Connection
+    """
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    db = sqlite3.connect(filename)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+class ReviewLog(object):
+
+    def __init__(self, filename=REVIEW_DB):
+        """Opens the review log in filename and starts its writer thread.
+
+        __init__(ReviewLog, str) --> void
+        """
+        self._filename = filename
+        self._queue = Queue()
+        self._error = None
+        ready = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, args=(ready,))
+        self._writer.daemon = True
+        self._writer.start()
+        if not ready.wait(OPEN_TIMEOUT):
+            self._error = IOError("timed out opening review log {0}".format(filename))
+        if self._error is not None:
+            raise self._error
+
+    def get_error(self):
+        """Returns the last error opening or writing the log, or None.
+
+        get_error(ReviewLog) --> Exception
+        """
+        return self._error
+
+    def record(self, card, mode, answer, correct, response_ms):
+        """Queues a graded answer to be written.
+
+        record(ReviewLog, str, str, str, bool, int) --> void
+        """
+        now = time.time()
+        self._queue.put((now, int(now // DAY), card, mode, answer, int(bool(correct)),
+                         int(response_ms)))
+
+    def flush(self):
+        """Waits until every queued answer has been written, or returns at
+
+        once if the writer thread has stopped.
+
+        flush(ReviewLog) --> void
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        while not done.wait(0.1):
+            if not self._writer.is_alive():
+                return
+
+    def close(self):
+        """Writes the queued answers and stops the writer thread.
+
+        close(ReviewLog) --> void
+        """
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def _write_loop(self, ready):
+        """Writes queued answers in batches until close is called.
+
+        A batch is written once BATCH_SIZE answers are waiting or the oldest
+        has waited FLUSH_INTERVAL seconds.
+
+        _write_loop(ReviewLog, threading.Event) --> void
+        """
+        try:
+            db = connect(self._filename)
+        except (sqlite3.Error, EnvironmentError) as e:
+            self._error = e
+            return
+        finally:
+            ready.set()
+        running = True
+        while running:
+            batch = []
+            waiting = []
+            item = self._queue.get()
+            deadline = time.time() + FLUSH_INTERVAL
+            while True:
+                if item is None:
+                    running = False
+                elif isinstance(item, tuple):
+                    batch.append(item)
+                else:
+                    waiting.append(item)
+                if not running or waiting or len(batch) >= BATCH_SIZE:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.time()))
+                except Empty:
+                    break
+            try:
+                if batch:
+                    with db:
+                        db.executemany(INSERT, batch)
+            except sqlite3.Error as e:
+                #Drop the batch rather than stop logging.
+                self._error = e
+            finally:
+                for done in waiting:
+                    done.set()
+        db.close()
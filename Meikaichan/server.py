@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+
+"""
+Multi-learner quiz server for Meikaichan.
+
+Serves one deck to many learners over HTTP/JSON from a single asyncio
+process. The Cardlist, its distractor and answer indexes and the asset
+cache are loaded once and shared read-only; each learner only has a
+QuizSession (counters, no-repeat window, current question) and the deadline
+of the question being asked. Answers are graded by QuizSession.submit, as
+in the app. Requires Python 3.5 or later.
+
+    POST   /sessions               {"mode": "meikai"}   start a session
+    GET    /sessions/<id>                               its state and question
+    POST   /sessions/<id>/answer   {"answer": "Fire"}   grade, ask the next
+    DELETE /sessions/<id>                               end it
+    GET    /assets/<id>                                 an image or audio file
+    GET    /stats                                       server counters
+
+Assets are named by opaque ids, as their file names often spell out the
+meaning asked for. An answer arriving after the question's ANSWER_SECONDS
+have passed counts as timed out, as when the app's countdown expires.
+Sessions idle for SESSION_TTL seconds are dropped.
+
+Usage:
+
+    python server.py "Kanji 6.json" [--host 127.0.0.1] [--port 8080]
+
+See loadgen.py for a load generator.
+"""
+
+import os
+import sys
+import json
+import uuid
+import hashlib
+import asyncio
+import argparse
+import mimetypes
+from email.utils import formatdate
+
+from cards import Cardlist
+from deckcache import DeckCache
+from assets import FileCache
+from distractors import DistractorIndex
+from answers import AnswerIndex
+from quiz import QuizSession, MODES, MEIKAI, REIKAI, ANSWER_SECONDS
+from timers import monotonic
+
+HOST = '127.0.0.1'
+PORT = 8080
+
+#Seconds a session may stay idle, and between sweeps for idle sessions.
+SESSION_TTL = 3600
+SWEEP_INTERVAL = 60
+
+#Largest request head and body accepted, in bytes.
+MAX_HEAD = 8192
+MAX_BODY = 65536
+
+#Bytes of asset files kept in memory, and how long clients may cache them.
+ASSET_CACHE_BYTES = 64 * 1024 * 1024
+ASSET_MAX_AGE = 86400
+
+REASONS = {200: 'OK', 201: 'Created', 204: 'No Content', 304: 'Not Modified',
+           400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           409: 'Conflict', 413: 'Payload Too Large'}
+
+class HTTPError(Exception):
+
+    def __init__(self, status, message):
+        """Initializes an error answered with status and message.
+
+        __init__(HTTPError, int, str) --> void
+        """
+        Exception.__init__(self, message)
+        self.status = status
+
+class Learner(object):
+    """Per-learner state: the quiz session and the current deadline."""
+
+    __slots__ = ('session', 'deadline', 'seen')
+
+    def __init__(self, session):
+        self.session = session
+        self.deadline = None
+        self.seen = monotonic()
+
+def load_asset(path):
+    """Reads the file at path and returns (data, etag, last modified).
+
+    load_asset(str) --> (bytes, str, str)
+    """
+    with open(path, 'rb') as fd:
+        data = fd.read()
+    stat = os.stat(path)
+    etag = '"{0:x}-{1:x}"'.format(int(stat.st_mtime), stat.st_size)
+    return data, etag, formatdate(stat.st_mtime, usegmt=True)
+
+class QuizServer(object):
+
+    def __init__(self, cardlist, base='.'):
+        """Initializes a server quizzing learners on cardlist, serving asset
+
+        paths relative to the directory base.
+
+        __init__(QuizServer, Cardlist, str) --> void
+        """
+        self._items = cardlist
+        self._base = os.path.realpath(base)
+        self._distractors = DistractorIndex()
+        self._distractors.extend(cardlist)
+        self._answers = AnswerIndex()
+        self._answers.extend(cardlist)
+        self._assets = FileCache(load_asset, lambda asset: len(asset[0]), ASSET_CACHE_BYTES)
+        #Opaque ids of the asset paths handed out, and back.
+        self._secret = os.urandom(16)
+        self._asset_ids = {}
+        self._asset_paths = {}
+        self._learners = {}
+        self._requests = 0
+        self._started = monotonic()
+
+    def _question(self, learner):
+        """Asks the learner's next question and returns it as JSON data.
+
+        _question(QuizServer, Learner) --> dict
+        """
+        learner.session.next_question()
+        learner.deadline = monotonic() + ANSWER_SECONDS
+        return self._describe(learner)
+
+    def _asset_url(self, path):
+        """Returns the URL of the asset path, under an id that does not give
+
+        its file name away.
+
+        _asset_url(QuizServer, str) --> str
+        """
+        key = self._asset_ids.get(path)
+        if key is None:
+            digest = hashlib.sha1(self._secret + path.encode('utf-8')).hexdigest()[:20]
+            key = digest + os.path.splitext(path)[1].lower()
+            self._asset_ids[path] = key
+            self._asset_paths[key] = path
+        return '/assets/' + key
+
+    def _describe(self, learner):
+        """Returns the learner's current question as JSON data, without the
+
+        answer: the reading and the audio, which speaks it, are left out in
+        Reikai, the choices are only given in Meikai, and assets are named
+        by opaque ids.
+
+        _describe(QuizServer, Learner) --> dict
+        """
+        session = learner.session
+        card = session.get_question().card
+        data = {'kanji': card.get_kanji(),
+                'image': self._asset_url(card.get_image()),
+                'seconds': max(0, learner.deadline - monotonic())}
+        if session.get_mode() != REIKAI:
+            data['hiragana'] = card.get_hiragana()
+            data['audio'] = self._asset_url(card.get_audio())
+        if session.get_mode() == MEIKAI:
+            data['choices'] = session.get_question().choices
+        return data
+
+    def _state(self, key, learner):
+        """Returns the counters of the learner's session as JSON data.
+
+        _state(QuizServer, str, Learner) --> dict
+        """
+        session = learner.session
+        return {'session': key,
+                'mode': session.get_mode(),
+                'attempts': session.get_attempts(),
+                'correct': session.get_correct(),
+                'complete': session.is_complete()}
+
+    def _learner(self, key):
+        """Returns the learner with session key, marking it active.
+
+        _learner(QuizServer, str) --> Learner
+        """
+        learner = self._learners.get(key)
+        if learner is None:
+            raise HTTPError(404, "no session {0}".format(key))
+        learner.seen = monotonic()
+        return learner
+
+    def start(self, mode):
+        """Starts a session in mode and returns its state and first question.
+
+        start(QuizServer, str) --> dict
+        """
+        if mode not in MODES:
+            raise HTTPError(400, "unknown mode {0}".format(mode))
+        if not self._items.length():
+            raise HTTPError(409, "the deck is empty")
+        session = QuizSession(self._items, mode, distractors=self._distractors,
+                              answers=self._answers)
+        key = uuid.uuid4().hex
+        learner = self._learners[key] = Learner(session)
+        data = self._state(key, learner)
+        data['question'] = self._question(learner)
+        return data
+
+    def show(self, key):
+        """Returns the state and the current question of session key.
+
+        show(QuizServer, str) --> dict
+        """
+        learner = self._learner(key)
+        data = self._state(key, learner)
+        if learner.session.get_question() is not None and not learner.session.is_complete():
+            data['question'] = self._describe(learner)
+        return data
+
+    def answer(self, key, text):
+        """Grades text as the answer of session key and asks the next question.
+
+        answer(QuizServer, str, str) --> dict
+        """
+        learner = self._learner(key)
+        session = learner.session
+        if session.is_complete():
+            raise HTTPError(409, "session complete")
+        card = session.get_question().card
+        timed_out = monotonic() > learner.deadline
+        if timed_out:
+            session.expire()
+            correct = False
+        else:
+            correct = session.submit(text)
+        data = self._state(key, learner)
+        data.update({'verdict': correct, 'timed_out': timed_out,
+                     'meaning': card.get_meaning(), 'hiragana': card.get_hiragana()})
+        if not session.is_complete():
+            data['question'] = self._question(learner)
+        return data
+
+    def end(self, key):
+        """Ends session key.
+
+        end(QuizServer, str) --> void
+        """
+        self._learner(key)
+        del self._learners[key]
+
+    def stats(self):
+        """Returns the server counters as JSON data.
+
+        stats(QuizServer) --> dict
+        """
+        return {'cards': self._items.length(), 'sessions': len(self._learners),
+                'requests': self._requests, 'uptime': monotonic() - self._started,
+                'assets': self._assets.get_stats()}
+
+    def sweep(self):
+        """Drops the sessions idle for more than SESSION_TTL seconds.
+
+        sweep(QuizServer) --> int
+        """
+        cutoff = monotonic() - SESSION_TTL
+        idle = [key for key, learner in self._learners.items() if learner.seen < cutoff]
+        for key in idle:
+            del self._learners[key]
+        return len(idle)
+
+    def asset(self, key, headers):
+        """Returns the status, headers and body answering a request for the
+
+        asset with the id key, given out in a question.
+
+        asset(QuizServer, str, dict) --> (int, list, bytes)
+        """
+        path = self._asset_paths.get(key)
+        if path is None:
+            raise HTTPError(404, "no asset {0}".format(key))
+        filename = os.path.realpath(os.path.join(self._base, path))
+        if not filename.startswith(self._base + os.sep) or not os.path.isfile(filename):
+            raise HTTPError(404, "no asset {0}".format(path))
+        data, etag, modified = self._assets.load(filename)
+        cache = [('Cache-Control', 'public, max-age={0}'.format(ASSET_MAX_AGE)),
+                 ('ETag', etag), ('Last-Modified', modified)]
+        if headers.get('if-none-match') == etag:
+            return 304, cache, b''
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        return 200, cache + [('Content-Type', content_type)], data
+
+    def dispatch(self, method, target, headers, body):
+        """Answers one request, returning its status, headers and body.
+
+        dispatch(QuizServer, str, str, dict, bytes) --> (int, list, bytes)
+        """
+        self._requests += 1
+        path = target.split('?', 1)[0]
+        parts = [part for part in path.split('/') if part]
+        try:
+            if parts[:1] == ['assets'] and method in ('GET', 'HEAD'):
+                return self.asset('/'.join(parts[1:]), headers)
+            request = json.loads(body.decode('utf-8')) if body else {}
+            if not isinstance(request, dict):
+                raise HTTPError(400, "expected a JSON object")
+            if parts == ['sessions'] and method == 'POST':
+                return self._json(201, self.start(request.get('mode', MEIKAI)))
+            elif len(parts) == 2 and parts[0] == 'sessions' and method == 'GET':
+                return self._json(200, self.show(parts[1]))
+            elif len(parts) == 2 and parts[0] == 'sessions' and method == 'DELETE':
+                self.end(parts[1])
+                return 204, [], b''
+            elif len(parts) == 3 and parts[0] == 'sessions' and parts[2] == 'answer' and method == 'POST':
+                return self._json(200, self.answer(parts[1], str(request.get('answer', ''))))
+            elif parts == ['stats'] and method == 'GET':
+                return self._json(200, self.stats())
+            raise HTTPError(404 if method in ('GET', 'POST', 'DELETE') else 405,
+                            "no route {0} {1}".format(method, path))
+        except HTTPError as e:
+            return self._json(e.status, {'error': str(e)})
+        except ValueError as e:
+            return self._json(400, {'error': str(e)})
+
+    def _json(self, status, data):
+        """Returns a JSON response of data.
+
+        _json(QuizServer, int, dict) --> (int, list, bytes)
+        """
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        return status, [('Content-Type', 'application/json; charset=utf-8')], body
+
+    async def handle(self, reader, writer):
+        """Answers the requests of one keep-alive connection.
+
+        handle(QuizServer, StreamReader, StreamWriter) --> void
+        """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ', 2)
+                except ValueError:
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(':')
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+                connection = headers.get('connection', '').lower()
+                keep = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= MAX_BODY:
+                    status, extra, data = self._json(413, {'error': "bad body length"})
+                    keep = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status, extra, data = self.dispatch(method, target, headers, body)
+                response = ['HTTP/1.1 {0} {1}'.format(status, REASONS.get(status, 'Error')),
+                            'Content-Length: {0}'.format(len(data))]
+                response.extend('{0}: {1}'.format(name, value) for name, value in extra)
+                if not keep:
+                    response.append('Connection: close')
+                if method == 'HEAD':
+                    data = b''
+                writer.write(('\r\n'.join(response) + '\r\n\r\n').encode('latin-1') + data)
+                await writer.drain()
+                if not keep:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def sweeper(self):
+        """Drops idle sessions every SWEEP_INTERVAL seconds, forever.
+
+        sweeper(QuizServer) --> void
+        """
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            self.sweep()
+
+def serve(server, host=HOST, port=PORT):
+    """Runs server on host and port until interrupted.
+
+    serve(QuizServer, str, int) --> void
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    listener = loop.run_until_complete(
+        asyncio.start_server(server.handle, host, port, limit=MAX_HEAD, backlog=1024))
+    sweeper = loop.create_task(server.sweeper())
+    sys.stderr.write("Serving on http://{0}:{1}/\n".format(host, port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sweeper.cancel()
+        listener.close()
+        loop.run_until_complete(listener.wait_closed())
+
+def main(argv=None):
+    """Loads a deck and serves it to learners.
+
+    main(list(str)) --> int
+    """
+    parser = argparse.ArgumentParser(description="Serve a Meikaichan deck to many learners.")
+    parser.add_argument('deck', help="deck to quiz on")
+    parser.add_argument('--host', default=HOST, help="address to listen on")
+    parser.add_argument('--port', type=int, default=PORT, help="port to listen on")
+    parser.add_argument('--assets', default='.', help="directory asset paths are relative to")
+    args = parser.parse_args(argv)
+    cardlist = Cardlist(DeckCache())
+    report = cardlist.load_file(args.deck)
+    if not report.is_clean():
+        sys.stderr.write(str(report) + "\n")
+    serve(QuizServer(cardlist, args.assets), args.host, args.port)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
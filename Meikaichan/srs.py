@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+Spaced repetition for Meikaichan.
+
+ReviewScheduler keeps an SM-2 style schedule for every card that has been
+answered: its ease, its interval in days, the number of correct answers in
+a row and the time it is next due. Cards are keyed by meaning, the key of
+the deck file, so a schedule survives edits that reorder a deck. Due cards
+sit in a heap ordered by due time, so finding the most overdue card costs
+O(log n) however large the deck is.
+"""
+
+import os
+import json
+import time
+import heapq
+import hashlib
+
+from deckcache import replace_file
+
+SCHEDULE_DIR = os.path.join(os.path.expanduser('~'), '.meikaichan', 'progress')
+
+#SM-2 constants.
+INITIAL_EASE = 2.5
+MINIMUM_EASE = 1.3
+DAY = 24 * 60 * 60
+
+#A card answered wrongly comes back this many seconds later.
+RELEARN_DELAY = 5 * 60
+
+#Answer qualities, from the SM-2 scale of 0 to 5.
+QUALITY_CORRECT = 4
+QUALITY_WRONG = 1
+QUALITY_TIMEOUT = 0
+
+def schedule_path(deckname):
+    """Returns the file the schedule of the deck file deckname is kept in.
+
+    schedule_path(str) --> str
+    """
+    deckname = os.path.abspath(deckname)
+    digest = hashlib.sha1(deckname.encode('utf-8')).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(deckname))[0]
+    return os.path.join(SCHEDULE_DIR, u"{0}-{1}.json".format(name, digest))
+
+class ReviewScheduler(object):
+
+    def __init__(self, clock=time.time):
+        """Initializes an empty schedule. clock returns the time in seconds.
+
+        __init__(ReviewScheduler, callable) --> void
+        """
+        self._clock = clock
+        #meaning -> [ease, interval in days, repetitions, due time]
+        self._cards = {}
+        #(due time, meaning) entries; those whose due time no longer matches
+        #the card's are stale and skipped when they reach the top.
+        self._heap = []
+
+    def __len__(self):
+        """Returns the number of scheduled cards.
+
+        __len__(ReviewScheduler) --> int
+        """
+        return len(self._cards)
+
+    def get(self, meaning):
+        """Returns (ease, interval, repetitions, due) for meaning, or None if
+
+        the card has never been answered.
+
+        get(ReviewScheduler, str) --> tuple
+        """
+        state = self._cards.get(meaning)
+        return tuple(state) if state is not None else None
+
+    def _set(self, meaning, ease, interval, repetitions, due):
+        """Stores the schedule of meaning and queues it by due time.
+
+        _set(ReviewScheduler, str, float, float, int, float) --> void
+        """
+        self._cards[meaning] = [ease, interval, repetitions, due]
+        heapq.heappush(self._heap, (due, meaning))
+        #Rebuild once stale entries dominate, keeping the heap O(n).
+        if len(self._heap) > 2 * len(self._cards) + 64:
+            self._heap = [(state[3], key) for key, state in self._cards.items()]
+            heapq.heapify(self._heap)
+
+    def review(self, meaning, quality):
+        """Updates the schedule of meaning after an answer of quality 0-5.
+
+        review(ReviewScheduler, str, int) --> void
+        """
+        now = self._clock()
+        state = self._cards.get(meaning)
+        ease, interval, repetitions = (INITIAL_EASE, 0.0, 0) if state is None else state[:3]
+        ease = max(MINIMUM_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+        if quality < 3:
+            self._set(meaning, ease, 0.0, 0, now + RELEARN_DELAY)
+            return
+        repetitions += 1
+        if repetitions == 1:
+            interval = 1.0
+        elif repetitions == 2:
+            interval = 6.0
+        else:
+            interval = interval * ease
+        self._set(meaning, ease, interval, repetitions, now + interval * DAY)
+
+    def next_due(self):
+        """Returns the meaning of the most overdue card, or None if no card
+
+        is due yet.
+
+        next_due(ReviewScheduler) --> str
+        """
+        heap = self._heap
+        now = self._clock()
+        while heap:
+            due, meaning = heap[0]
+            state = self._cards.get(meaning)
+            if state is None or state[3] != due:
+                heapq.heappop(heap)
+                continue
+            return meaning if due <= now else None
+        return None
+
+    def discard(self, meaning):
+        """Forgets the schedule of meaning.
+
+        discard(ReviewScheduler, str) --> void
+        """
+        self._cards.pop(meaning, None)
+
+    def clear(self):
+        """Forgets the schedule of every card.
+
+        clear(ReviewScheduler) --> void
+        """
+        self._cards.clear()
+        del self._heap[:]
+
+    def save(self, filename):
+        """Writes the schedule to filename as JSON.
+
+        save(ReviewScheduler, str) --> void
+        """
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(filename + '.tmp', 'w') as fd:
+            json.dump(self._cards, fd)
+        replace_file(filename + '.tmp', filename)
+
+    def load(self, filename):
+        """Merges the schedule saved in filename, if it exists. A file that
+
+        cannot be read or parsed is ignored, leaving the schedule as it was,
+        and is overwritten by the next save.
+
+        load(ReviewScheduler, str) --> void
+        """
+        if not os.path.exists(filename):
+            return
+        try:
+            with open(filename) as fd:
+                saved = json.load(fd)
+            states = []
+            for meaning, state in saved.items():
+                ease, interval, repetitions, due = state
+                states.append((meaning, (float(ease), float(interval), int(repetitions), float(due))))
+        except (EnvironmentError, ValueError, TypeError, AttributeError):
+            return
+        for meaning, state in states:
+            self._set(meaning, *state)
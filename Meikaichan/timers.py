@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+"""
+Timers for Meikaichan.
+
+Scheduler owns every pending Tk after() call under a key, so scheduling a
+key again replaces the old call instead of starting a second chain.
+Countdown counts whole seconds down to a deadline on a monotonic clock,
+waking once per second however late the previous wakeup ran.
+Stopwatch records how long named stages took, e.g. during startup.
+
+Python 2 has no time.monotonic. There the clock is clock_gettime on Linux
+and macOS, through ctypes, and time.clock on Windows. Elsewhere it falls
+back to the wall clock, kept from running backwards; a wall clock set
+forward still makes timers expire early.
+"""
+
+import sys
+import math
+import time
+
+#clock_gettime clock ids of a monotonic clock.
+CLOCK_MONOTONIC = {'linux': 1, 'darwin': 6}
+
+def _clock_gettime():
+    """Returns a monotonic clock read with clock_gettime, or None where it
+
+    cannot be loaded.
+
+    _clock_gettime() --> callable
+    """
+    platform = 'linux' if sys.platform.startswith('linux') else sys.platform
+    if platform not in CLOCK_MONOTONIC:
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        library = ctypes.util.find_library('rt') or ctypes.util.find_library('c')
+        clock_gettime = ctypes.CDLL(library, use_errno=True).clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    except (ImportError, OSError, AttributeError):
+        return None
+    clock_id = CLOCK_MONOTONIC[platform]
+    spec = timespec()
+
+    def clock():
+        if clock_gettime(clock_id, ctypes.byref(spec)) != 0:
+            raise OSError(ctypes.get_errno(), "clock_gettime failed")
+        return spec.tv_sec + spec.tv_nsec * 1e-9
+
+    try:
+        clock()
+    except OSError:
+        return None
+    return clock
+
+def _never_backwards(clock):
+    """Returns clock, but never earlier than a time it already returned.
+
+    _never_backwards(callable) --> callable
+    """
+    last = [clock()]
+
+    def now():
+        last[0] = max(last[0], clock())
+        return last[0]
+    return now
+
+if hasattr(time, 'monotonic'):
+    monotonic = time.monotonic
+elif sys.platform == 'win32':
+    monotonic = time.clock
+else:
+    monotonic = _clock_gettime() or _never_backwards(time.time)
+
+class Scheduler(object):
+
+    def __init__(self, widget):
+        """Initializes a scheduler calling back through widget.after.
+
+        __init__(Scheduler, Widget) --> void
+        """
+        self._widget = widget
+        self._jobs = {}
+
+    def call_later(self, key, delay, callback):
+        """Calls callback after delay seconds, replacing any call pending
+
+        under key.
+
+        call_later(Scheduler, str, float, callable) --> void
+        """
+        self.cancel(key)
+        self._jobs[key] = self._widget.after(int(math.ceil(max(0, delay) * 1000)), self._run, key, callback)
+
+    def _run(self, key, callback):
+        """Forgets the call pending under key and runs callback.
+
+        _run(Scheduler, str, callable) --> void
+        """
+        self._jobs.pop(key, None)
+        callback()
+
+    def cancel(self, key):
+        """Cancels the call pending under key, if any.
+
+        cancel(Scheduler, str) --> void
+        """
+        job = self._jobs.pop(key, None)
+        if job is not None:
+            self._widget.after_cancel(job)
+
+    def cancel_all(self):
+        """Cancels every pending call.
+
+        cancel_all(Scheduler) --> void
+        """
+        for key in list(self._jobs):
+            self.cancel(key)
+
+    def is_pending(self, key):
+        """Returns True if a call is pending under key.
+
+        is_pending(Scheduler, str) --> bool
+        """
+        return key in self._jobs
+
+    def pending(self):
+        """Returns the number of pending calls.
+
+        pending(Scheduler) --> int
+        """
+        return len(self._jobs)
+
+class Countdown(object):
+
+    def __init__(self, scheduler, key, seconds, on_tick, on_expire):
+        """Initializes a countdown of seconds run by scheduler under key.
+
+        on_tick is called with the whole seconds remaining each time it
+        changes, and on_expire once the deadline has passed.
+
+        __init__(Countdown, Scheduler, str, int, callable, callable) --> void
+        """
+        self._scheduler = scheduler
+        self._key = key
+        self._seconds = seconds
+        self._on_tick = on_tick
+        self._on_expire = on_expire
+        self._deadline = None
+
+    def restart(self):
+        """Starts counting down from the full time, replacing any countdown
+
+        already running.
+
+        restart(Countdown) --> void
+        """
+        self._deadline = monotonic() + self._seconds
+        self._tick()
+
+    def stop(self):
+        """Stops the countdown.
+
+        stop(Countdown) --> void
+        """
+        self._deadline = None
+        self._scheduler.cancel(self._key)
+
+    def remaining(self):
+        """Returns the whole seconds remaining, or 0 when stopped.
+
+        remaining(Countdown) --> int
+        """
+        if self._deadline is None:
+            return 0
+        return max(0, int(math.ceil(self._deadline - monotonic())))
+
+    def _tick(self):
+        """Reports the seconds remaining and sleeps until the next whole
+
+        second before the deadline, or expires the countdown.
+
+        _tick(Countdown) --> void
+        """
+        left = self._deadline - monotonic()
+        if left <= 0:
+            self._deadline = None
+            self._on_expire()
+            return
+        remaining = int(math.ceil(left))
+        self._on_tick(remaining)
+        self._scheduler.call_later(self._key, left - (remaining - 1), self._tick)
+
+class Stopwatch(object):
+
+    def __init__(self, start=None):
+        """Initializes a stopwatch started at the monotonic time start, by
+
+        default now.
+
+        __init__(Stopwatch, float) --> void
+        """
+        self._start = monotonic() if start is None else start
+        self._last = self._start
+        self._marks = []
+
+    def mark(self, stage):
+        """Records that stage ended now.
+
+        mark(Stopwatch, str) --> void
+        """
+        now = monotonic()
+        self._marks.append((stage, now - self._last, now - self._start))
+        self._last = now
+
+    def get_marks(self):
+        """Returns (stage, seconds taken, seconds since start) of each mark.
+
+        get_marks(Stopwatch) --> list(tuple)
+        """
+        return list(self._marks)
+
+    def __str__(self):
+        """Returns one line per stage with its time and the running total.
+
+        __str__(Stopwatch) --> str
+        """
+        return "\n".join("{0:<16}{1:>8.1f}ms{2:>9.1f}ms".format(stage, taken * 1000, total * 1000)
+                         for stage, taken, total in self._marks)